@@ -10,47 +10,239 @@
 
 # Funtion List
 # connect - Establishes usb connection
+# waitForDevice - Sleeps until the arduino's device node appears
+# waitReady - Waits for the sketch's ready banner
+# parseBanner - Reads the frame version from the ready banner
 # reset - Resets the arduino
 # tellArm - Sends a G-Code string to the arduino as a number
 # exit - Break usb connection
 # gCode2num - Converts the G-Code string to the number
+# ArmPipeline - Keeps several sequence-numbered commands in flight at once
+# tellArmBatch - Sends many G-Code strings per write and collects all the replies
+# writePort - Writes to the arduino, reconnecting once if it was unplugged
+# autoBatch - Makes tellArm merge commands issued close together into batches
+# flushBatch - Sends any commands tellArm is holding for a batch
+# parseGCode - Splits a G-Code string into (letter, joint, value)
+# encodeFrame - Packs (letter, joint, value) commands into one checksummed binary frame
+# decodeFrame - Unpacks a binary frame back into (letter, joint, value) commands
+# encodeSequenced - Encodes one sequence-numbered command in the active protocol
+# parseAck - Splits a "#ss <gcode>" or "!ss <error>" reply into its parts
+# AsyncArm - asyncio client that owns its own serial port
+# startReader - Starts a thread that reads every reply from the arduino
+# keepLine - Queues a reply no future was waiting for, keeping only the newest
+# stopReader - Stops the reader thread
+# tellArmFuture - Sends a command and returns a Future for its reply
+# readGCode - Lazily reads G-Code commands from a file or any iterable of lines
+# streamGCode - Sends a whole G-Code program using credit-based flow control
+# encodeMany - gCode2num for whole NumPy arrays of commands at once
+# recordLatency - Adds one send-to-ack time to its letter's histogram
+# latencySnapshot - Histograms, percentiles and link counters so far
+# resetLatency - Clears the histograms and counters
+# SerialDevice - One serial link with its own worker thread
+# DeviceManager - Several serial links keyed by role, found through /dev/serial/by-id
+# SetpointQueue - Outbound queue where a newer setpoint replaces a pending one for the same joint
+# decodeMany - num2gCode (simpleGCode.ino) for whole NumPy arrays of codes at once
+# readLine - Reads one reply, giving up after a timeout
+# readReply - Reads the reply to one command, skipping stale ones
+# readPort - Sleeps in select until a whole reply line arrives
+# resync - Drops half received replies after a lost ack
+# ArmTimeout - Raised when the arduino does not answer within ackDeadline
 
 # %% Start Imports ###
+import os                   # Checks the device exists
 import time                 # Allows to pause
+import threading            # Protects the sequence counter
+import struct               # Packs binary frames
+import asyncio              # Event loop based client
+import queue                # Hands replies from the reader thread to readLine
+import concurrent.futures   # Per-command results from the reader thread
+import collections          # Lookahead buffer for streamGCode
+import bisect               # Finds latency buckets
+import glob                 # Lists /dev/serial/by-id
+import select               # Sleeps until the port has data
+import ctypes               # inotify, sleeps until the device node appears
 import serial as ser        # Interfaces with the arduino
 ### End imports ###
 
+protocol = "ascii"              # "ascii" sends gCode2num codes, "binary" sends frames from encodeFrame
+readyBanner = "READY simpleGCode"   # Start of the line the sketch prints when setup finishes
+boardVersion = None             # Frame version from the banner, None until a banner is seen
+armPort = '/dev/ttyACM0'        # Serial device of the arduino, connect without a port reconnects to it
+connectWait = 30.0              # Longest wait in seconds for the board to appear, None waits forever
+reconnectWait = 5.0             # Longest wait in seconds for the board to come back after a failed write
+reconnectDelay = 0.05           # First wait between looks for the board, doubled each time
+reconnectDelayMax = 2.0         # Longest wait between looks for the board
+rxBuffer = 64                   # Bytes the arduino's serial receive buffer holds
+uno = None                      # Serial connection, opened by connect
+lineBuffer = bytearray()        # Bytes of a reply line that has not finished arriving
+ackDeadline = 1.0               # Longest wait in seconds for an ack before it counts as lost
+retries = 2                     # Times tellArm resends a lost setpoint (see coalescable) before giving up
+
+latencyBuckets = [0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, float('inf')]
+latencyCounts = {}              # Letter -> command count per bucket, bucket i holds times up to latencyBuckets[i]
+reconnects = 0                  # Times connect was called after a connection had been made
+timeouts = 0                    # Waits that ran out of time
+statsLock = threading.Lock()    # Protects the histograms and counters
+
+# Part of the /dev/serial/by-id name that identifies each board, use a serial number when two boards match
+deviceIds = {"arm": "Arduino", "drive": "Teensy"}
+
+# Letters that set an absolute target for a joint, so only the newest one pending for a joint matters
+# Every other letter is never merged and keeps its place in line
+coalescable = {'P', 'S', 'Q'}
+
+nextSeq = 0                     # Sequence number for the next "#" command
+seqLock = threading.Lock()      # Keeps sequence numbers unique across threads
+
+batchLimit = 10                 # Commands per write, 10 x 6 characters fits the arduino's 64 byte buffer
+batchWindow = 0                 # Seconds tellArm holds commands to merge them, 0 sends right away
+batchQueue = []                 # Commands held by tellArm
+batchTimer = None               # Timer that sends the held commands
+batchLock = threading.Lock()    # Protects batchQueue and batchTimer
+
+reader = None                   # Thread that reads every reply while it runs
+readerRunning = False           # Tells the reader thread to keep going
+readerQueue = queue.Queue(64)   # Replies no future was waiting for, read by readLine, the oldest goes when full
+lateSeqs = set()                # Sequence numbers of futures given up on, their acks are dropped if they turn up
+futures = {}                    # Sequence number -> (Future waiting for its ack, gCode, time sent)
+futuresLock = threading.Lock()  # Protects futures
+futuresWindow = threading.BoundedSemaphore(7)   # Futures in flight, 7 x 9 bytes fits the 64 byte buffer
+
+# Binary frame: sync, version, seq, payload length, payload, crc8 of everything after sync
+# Payload: 4 bytes per command - letter code, joint, value (little endian int16)
+# The arduino replies "#ss <gcode>" per command (ss = frame seq + position) or "!ss <error>" per frame
+letterCodes = {'P': 1, 'S': 2, 'Q': 3, 'M': 4, 'R': 5, 'K': 6, 'H': 7, 'E': 8}
+codeLetters = {code: letter for letter, code in letterCodes.items()}
+frameSync = 0xA5                            # First byte of every frame
+frameVersion = 1                            # Frame layout version
+frameHeader = struct.Struct('<BBBB')        # sync, version, seq, payload length
+frameCommand = struct.Struct('<BBh')        # letter code, joint, value
+frameLimit = 14                             # Commands per frame, 5 + 14 x 4 bytes fits the 64 byte buffer
+crcTable = []                               # CRC-8 (polynomial 0x07) of every byte value
+for crc in range(256):
+    for bit in range(8):
+        crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    crcTable.append(crc)
+
 #%%####### Start Custom Functions ##########
 
 
-def connect():
+def connect(port=None, deadline=3.0, wait=None):
     # Function to establish a connection with an arduino using serial connection via a USB cable
-    # Inputs  : none
+    # Inputs  : port     - serial device of the arduino, the last one connected to if not given
+    #           deadline - longest wait in seconds for the sketch's ready banner
+    #           wait     - longest wait in seconds for the board to appear, connectWait if not given
     # Outputs : none
     # Globals : uno - Holds the serial connection to the arduino
+    # Raises  : ArmError - the board could not be opened within wait
 
-    global uno  # Serial communication variable
+    global uno, reconnects, armPort  # Serial communication variable
 
+    if uno is not None:                                         # Lost an earlier connection
+        with statsLock:
+            reconnects += 1
+    armPort = port = port or armPort
+    wait = connectWait if wait is None else wait
+    end = None if wait is None else time.monotonic() + wait
+    delay = reconnectDelay                                      # Backoff between failed opens
+    warned = False                                              # Only complain once
     while True:                                                 # Loop until the connection has been established
         try:
-            uno = ser.Serial('/dev/ttyACM0', 115200, timeout=0.1)       # Enable arduino communication (pi)
+            uno = ser.Serial(port, 115200, timeout=0.1)       # Enable arduino communication (pi)
             # Notes for serial function which established the connection:
             # Inputs  : port - String name of the port which the arduino connects to the device
             #           baudWidth - Rate of communication between pi and arduino (MUST be the same on both)
             #           timeout=0.1 - Specifies seconds for the arduino to wait for data
             # Outputs : uno - serial connection between devices
-        except:
-            print("ERROR : The arudino is not connected to the Pi. Attempting to reconnect...")     # Inform that the connection has not been made
-            time.sleep(0.5)                                             # Wait half a second
-        else:
-            time.sleep(1.8)                                             # Gives the connection time to finalize
-            print("--- Arduino Connection Is Established ---")
-            print("-----------------------------------------")
             break
+        except (ser.SerialException, OSError):
+            if not warned:
+                print("ERROR : The arudino is not connected to the Pi. Attempting to reconnect...")     # Inform that the connection has not been made
+                warned = True
+        remaining = None if end is None else end - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            raise ArmError("No arduino on " + port + " after " + str(wait) + " s")
+        if os.path.exists(port):                                    # There but not ready (udev still setting it up)
+            time.sleep(delay if remaining is None else min(delay, remaining))
+            delay = min(delay * 2, reconnectDelayMax)
+        else:                                                       # Unplugged, sleep until the kernel adds it
+            waitForDevice(port, remaining)
+    lineBuffer.clear()                                          # Nothing half read survives a new port
+    waitReady(deadline)                                         # Opening the port resets the board
+    print("--- Arduino Connection Is Established ---")
+    print("-----------------------------------------")
+
+
+def waitForDevice(port, timeout=None):
+    # Sleeps until a device node exists, woken by inotify as soon as it is created
+    # The existence check also backs off from reconnectDelay to reconnectDelayMax, in case inotify is missing
+    # or its folder does not exist yet (/dev/serial/by-id is only made once a board is plugged in)
+    # Inputs  : port    - device to wait for
+    #           timeout - longest wait in seconds, None waits forever
+    # Outputs : found - True if the device exists
+    # Globals : reconnectDelay, reconnectDelayMax - Backoff between checks
+
+    end = None if timeout is None else time.monotonic() + timeout
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        watch = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        # IN_ATTRIB | IN_MOVED_TO | IN_CREATE, udev fixes the permissions after the node is created
+        if watch >= 0 and libc.inotify_add_watch(watch, os.path.dirname(port).encode(), 0x4 | 0x80 | 0x100) < 0:
+            os.close(watch)
+            watch = -1
+    except (OSError, AttributeError):                           # Not linux
+        watch = -1
+    delay = reconnectDelay
+    try:
+        while not os.path.exists(port):                         # Checked after the watch is set so nothing is missed
+            remaining = None if end is None else end - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            pause = delay if remaining is None else min(delay, remaining)
+            if watch >= 0 and select.select([watch], [], [], pause)[0]:
+                os.read(watch, 4096)                                # Something changed in the folder, look again
+            else:
+                delay = min(delay * 2, reconnectDelayMax)
+        return True
+    finally:
+        if watch >= 0:
+            os.close(watch)
+
+
+def waitReady(deadline=3.0):
+    # Waits for the ready banner the sketch prints at the end of setup
+    # Inputs  : deadline - longest wait in seconds
+    # Outputs : ready - True if the banner arrived in time
+    # Globals : boardVersion - Frame version announced by the sketch
+
+    global boardVersion
+
+    end = time.monotonic() + deadline
+    while time.monotonic() < end:
+        line = readLine(end - time.monotonic())
+        if line and line.startswith(readyBanner):                  # Sketch is up
+            boardVersion = parseBanner(line)
+            return True
+    countTimeout()
+    print("WARNING : No ready banner from the arduino, it may be running an older sketch")
+    return False
+
+
+def parseBanner(line):
+    # Reads the frame version from the ready banner, a garbled one must not stop the reader
+    # Inputs  : line - banner without its line ending, e.g. "READY simpleGCode 1"
+    # Outputs : version - frame version, None if it could not be read
+    # Globals : readyBanner - Start of the banner
+
+    try:
+        return int(line[len(readyBanner):])
+    except ValueError:                                  # Line noise while the board was resetting
+        print("WARNING : Could not read the frame version from " + repr(line))
+        return None
 
 
 def reset():
-    # Function reset the connected arduino and gives a 2-second delay to allow the arduino to finish resetting
+    # Function reset the connected arduino and waits for it to announce it has finished resetting
     # Inputs  : none
     # Outputs : none
     # Globals : uno - Holds the serial connection to the arduino
@@ -58,34 +250,893 @@ def reset():
     global uno              # Call the connection
     uno.setDTR(False)       # Set active to false
     time.sleep(0.1)         # Give it 1/10 second to process
+    resync()                # Drop replies from before the reset
     uno.setDTR(True)        # Set active to true
-    time.sleep(1.9)           # Allow uno to run the setup function and start
+    waitReady()             # Allow uno to run the setup function and start
 
 
 def tellArm(gCode):
     # Tells the arduino what to do
     # Inputs  : gCode - command for the arm
-    # Outputs : none
+    # Outputs : reply - the arduino's reply (None while autoBatch is holding commands)
     # Globals : uno - Holds the serial connection to the arduino
     # Example : setPin(10, 0) - Turns off pin 10
+    # Raises  : ArmTimeout - no reply within ackDeadline, after retries resends for setpoints
+    #           ArmError   - the arduino rejected the frame, or was unplugged and did not come back within reconnectWait
+
+    global uno, batchTimer
+
+    if batchWindow:                                     # Merging is on, hold the command
+        with batchLock:
+            batchQueue.append(gCode)
+            if batchTimer is None:                          # First command of a new batch
+                batchTimer = threading.Timer(batchWindow, flushBatch)
+                batchTimer.daemon = True
+                batchTimer.start()
+        return None
+
+    if reader is not None:                              # The reader thread owns the port
+        future = tellArmFuture(gCode)
+        try:
+            return future.result(ackDeadline)               # The reader prints the reply too
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            dropFuture(future)                              # A late ack must not find it
+            countTimeout()
+            raise ArmTimeout(gCode + " was not acknowledged within " + str(ackDeadline) + " s")
+
+    seq = takeSeq() if protocol == "binary" else None   # The ascii protocol's replies carry no sequence number
+    if protocol == "binary":                            # One command frame
+        gCommand = encodeFrame([parseGCode(gCode)], seq)
+    else:                                               # Six digit code
+        gCommand = gCode2num(gCode).encode()
+
+    # Only setpoints are safe to send twice, anything else could run twice if just its ack was lost
+    attempts = retries + 1 if gCode.lstrip()[:1] in coalescable else 1
+    for attempt in range(attempts):
+        sentAt = writePort(gCommand)                    # Try to transmit through serial connection
+        ack = readReply(seq, ackDeadline)               # Sleeps until the reply or the deadline
+        if ack is not None:
+            if not ack[2]:                                  # The frame was rejected
+                resync()
+                raise ArmError(gCode + " was rejected: " + ack[1])
+            recordLatency(gCode, time.perf_counter() - sentAt)
+            return ack[1]                                   # Same reply text in both protocols
+        countTimeout()
+        resync()                                        # Drop anything half received
+        if attempt + 1 < attempts:
+            print("WARNING : No reply to " + gCode + ", sending it again")
+    raise ArmTimeout(gCode + " was not acknowledged after " + str(attempts) + " attempt(s)")
+
+
+def tellArmBatch(gCodes):
+    # Sends many commands with one write per batchLimit commands and reads all of their replies
+    # Inputs  : gCodes  - list of commands for the arm
+    # Outputs : replies - the arduino's replies, in order
+    # Globals : uno - Holds the serial connection to the arduino
+    # Example : tellArmBatch(["P0 -243", "Q0 443"])
+    # Raises  : ArmTimeout - a reply did not arrive within ackDeadline of the one before
+    #           ArmError   - the arduino rejected a frame or disconnected part way, the rest of the batch was not sent
 
     global uno
 
-    gCommand = gCode2num(gCode)
+    limit = frameLimit if protocol == "binary" else batchLimit
+    replies = []
+    for start in range(0, len(gCodes), limit):
+        chunk = gCodes[start:start + limit]
+        seq = takeSeq(len(chunk)) if protocol == "binary" else None
+        if protocol == "binary":                        # One frame for the chunk
+            data = encodeFrame([parseGCode(gCode) for gCode in chunk], seq)
+        else:                                           # Six digit codes back to back
+            data = ''.join([gCode2num(gCode) for gCode in chunk]).encode()
+        try:
+            sentAt = time.perf_counter()
+            uno.write(data)                                 # Whole chunk at once
+        except (ser.SerialException, OSError):
+            print("Arduino is no longer connected !!!")     # Warn about a disconnection if transmittion fails
+            connect(wait=reconnectWait)                     # Attempt to reconnect to arduino
+            raise ArmError("Disconnected after " + str(len(replies)) + " of " + str(len(gCodes)) + " batch commands")
+        while len(replies) < start + len(chunk):        # Collect every reply for the chunk, in order
+            expected = None if seq is None else (seq + len(replies) - start) % 256
+            ack = readReply(expected, ackDeadline)          # Every reply restarts the clock
+            if ack is None:                                 # Nothing more is coming
+                countTimeout()
+                resync()
+                raise ArmTimeout(str(start + len(chunk) - len(replies)) + " batch replies were lost")
+            if not ack[2]:                                  # The whole frame was rejected
+                resync()
+                raise ArmError("Batch rejected after " + str(len(replies)) + " of " + str(len(gCodes))
+                               + " commands: " + ack[1])
+            recordLatency(gCodes[len(replies)], time.perf_counter() - sentAt)
+            replies.append(ack[1])
+    return replies
+
+
+def writePort(data):
+    # Writes to the arduino, reconnecting once if the port has gone
+    # A failed write never reached the board, and reopening the port resets it, so sending again is safe
+    # Inputs  : data - bytes for the arduino
+    # Outputs : sentAt - time.perf_counter() of the write that went through
+    # Globals : uno - Holds the serial connection to the arduino
+    # Raises  : ArmError - the board did not come back within reconnectWait, or the write failed again
 
     try:
-        uno.write(str(gCommand).encode())                # Try to transmit through serial connection
-    except:
+        sentAt = time.perf_counter()
+        uno.write(data)
+        return sentAt
+    except (ser.SerialException, OSError):
         print("Arduino is no longer connected !!!")     # Warn about a disconnection if transmittion fails
-        connect()                          # Attempt to reconnect to arduino
-    else:
-        noResponse = 1                                  # Logical variable to know if the arduino has returned a response
-        while noResponse:
-            data = uno.readline()                       # Read the serial monitor
-            if data:                                    # If the serial monitor said anything
-                rawData = data.rstrip('\n'.encode('latin-1'))  # Convert monitor to bytes
-                print("Arduino: " + rawData.decode('latin-1'))  # Print data
-                noResponse = 0                          # Let main code progress
+    connect(wait=reconnectWait)                         # Attempt to reconnect to arduino
+    try:
+        sentAt = time.perf_counter()
+        uno.write(data)                                 # Then send it again
+        return sentAt
+    except (ser.SerialException, OSError) as error:
+        raise ArmError("The arduino could not be written to after reconnecting: " + repr(error))
+
+
+def autoBatch(window):
+    # Turns merging of tellArm calls on or off
+    # Inputs  : window - seconds to hold a command waiting for more, 0 turns merging off
+    # Outputs : none
+    # Globals : batchWindow - Seconds tellArm holds commands
+
+    global batchWindow
+
+    flushBatch()                # Do not strand commands held under the old setting
+    batchWindow = window
+
+
+def flushBatch():
+    # Sends every command tellArm is holding as one batch
+    # Inputs  : none
+    # Outputs : none
+    # Globals : batchQueue, batchTimer - Held commands and their timer
+
+    global batchQueue, batchTimer
+
+    with batchLock:
+        gCodes = batchQueue
+        batchQueue = []
+        if batchTimer is not None:
+            batchTimer.cancel()
+            batchTimer = None
+    if gCodes:
+        try:
+            tellArmBatch(gCodes)
+        except ArmError as error:                   # Nobody waits on held commands, so just report it
+            print("WARNING : Held commands were not all acknowledged: " + str(error))
+
+
+def takeSeq(count=1):
+    # Hands out the next sequence number (00-FF, then wraps)
+    # Inputs  : count - how many consecutive numbers to reserve, for a multi-command frame
+    # Outputs : seq - first reserved sequence number
+    # Globals : nextSeq - Sequence number for the next "#" command
+
+    global nextSeq
+
+    with seqLock:
+        seq = nextSeq
+        nextSeq = (nextSeq + count) % 256
+    with futuresLock:                                   # Reused, so an ack for it is no longer a late one
+        lateSeqs.difference_update((seq + i) % 256 for i in range(count))
+    return seq
+
+
+def readLine(timeout=None):
+    # Reads one response line from the arduino, or from the reader thread when it is running
+    # Inputs  : timeout - longest wait in seconds, the serial timeout if not given
+    # Outputs : line - response without the line ending, None if nothing arrived in time
+    # Globals : uno - Holds the serial connection to the arduino
+
+    if timeout is None:
+        timeout = uno.timeout
+    if reader is not None:                          # The reader thread owns the port
+        try:
+            return readerQueue.get(timeout=max(timeout, 0))
+        except queue.Empty:
+            return None
+    return readPort(timeout)
+
+
+def readPort(timeout):
+    # Sleeps in select until a whole line has arrived or the time is up, no polling
+    # Inputs  : timeout - longest wait in seconds
+    # Outputs : line - response without the line ending, None if nothing arrived in time
+    # Globals : lineBuffer - Bytes of an unfinished line
+
+    end = time.monotonic() + timeout
+    while b'\n' not in lineBuffer:
+        remaining = end - time.monotonic()
+        if remaining <= 0 or not select.select([uno.fileno()], [], [], remaining)[0]:
+            return None
+        lineBuffer.extend(uno.read(uno.in_waiting or 1))
+    end = lineBuffer.index(b'\n')
+    line = lineBuffer[:end].rstrip(b'\r').decode('latin-1')
+    del lineBuffer[:end + 1]
+    return line
+
+
+def readReply(seq, timeout):
+    # Reads until the reply to one command arrives, skipping replies left over from earlier commands
+    # Inputs  : seq     - sequence number the reply must carry, None for a plain ascii reply
+    #           timeout - longest wait in seconds
+    # Outputs : (seq, text, ok) - as parseAck, text is the whole line for an ascii reply, None if nothing arrived in time
+
+    end = time.monotonic() + timeout
+    while True:
+        line = readLine(end - time.monotonic())
+        if line is None:
+            return None
+        print("Arduino: " + line)
+        ack = parseAck(line)
+        if seq is None and ack is None and not line.startswith(readyBanner):   # Plain ascii reply
+            return (None, line, True)
+        if seq is not None and ack and ack[0] == seq:
+            return ack
+
+
+def resync():
+    # Drops everything received but not read, so a late reply is not taken for the next one
+    # Inputs  : none
+    # Outputs : none
+    # Globals : uno, lineBuffer - Serial connection and its unfinished line
+
+    lineBuffer.clear()
+    try:
+        uno.reset_input_buffer()
+    except (ser.SerialException, OSError):             # Port already gone
+        pass
+
+
+def countTimeout():
+    # Adds one to the timeouts counter
+    global timeouts
+
+    with statsLock:
+        timeouts += 1
+
+
+class ArmCommand:
+    """
+    One command sent through an ArmPipeline, done turns true once the arduino acknowledges it.
+    reply stays None if the arduino rejected the frame.
+    """
+    def __init__(self, seq, gCode):
+        self.seq = seq                      # Sequence number echoed back by the arduino
+        self.gCode = gCode                  # Command that was sent
+        self.reply = None                   # Arduino's decoded copy of the command
+        self.done = False                   # True once acknowledged
+        self.sentAt = time.perf_counter()   # Time it was handed to the pipeline
+
+
+class ArmPipeline:
+    """
+    Sends commands as "#" + two hex digit sequence number + gCode2num code, keeping up to window
+    of them in flight and matching the "#ss <gcode>" acknowledgements by sequence number.
+    The arduino buffers 64 bytes and each command is 9, so window should stay at 7 or below.
+    """
+    def __init__(self, window=4):
+        self.window = window                # Commands allowed in flight
+        self.inFlight = {}                  # Sequence number -> ArmCommand waiting for its ack
+
+    def send(self, gCode):
+        # Sends a command, waiting only if the window is already full
+        # Inputs  : gCode - command for the arm
+        # Outputs : command - ArmCommand to check or wait on
+        self.settle(lambda: len(self.inFlight) < self.window)    # Make room
+        command = ArmCommand(takeSeq(), gCode)
+        self.inFlight[command.seq] = command
+        uno.write(encodeSequenced(gCode, command.seq))
+        return command
+
+    def readAck(self, timeout=None):
+        # Reads one response and completes the command it acknowledges
+        # Inputs  : timeout - longest wait in seconds, the serial timeout if not given
+        # Outputs : acked - True if a command in flight was completed
+        line = readLine(timeout)
+        if line is None:                            # Nothing arrived in time
+            return False
+        print("Arduino: " + line)
+        ack = parseAck(line)
+        command = self.inFlight.pop(ack[0], None) if ack else None
+        if command is None:                         # Not one of ours
+            return False
+        command.reply = ack[1] if ack[2] else None
+        command.done = True
+        if ack[2]:                                  # Rejections are not round trips of the command
+            recordLatency(command.gCode, time.perf_counter() - command.sentAt)
+        return True
+
+    def settle(self, finished):
+        # Reads acks until finished() is true, giving up if none arrive for ackDeadline
+        # Inputs  : finished - function that says when to stop
+        # Outputs : none
+        # Raises  : ArmTimeout - the commands still in flight stay in inFlight
+        end = time.monotonic() + ackDeadline
+        while not finished():
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                countTimeout()
+                raise ArmTimeout(str(len(self.inFlight)) + " pipelined commands were not acknowledged")
+            if self.readAck(remaining):                 # Progress restarts the clock
+                end = time.monotonic() + ackDeadline
+
+    def wait(self, command):
+        # Blocks until one command is acknowledged
+        # Inputs  : command - ArmCommand returned by send
+        # Outputs : reply - the arduino's decoded copy of the command
+        self.settle(lambda: command.done)
+        return command.reply
+
+    def drain(self):
+        # Blocks until every command in flight is acknowledged
+        # Inputs  : none
+        # Outputs : none
+        self.settle(lambda: not self.inFlight)
+
+
+class ArmError(Exception):
+    """
+    The arduino rejected a command, the message is its "ERR ..." reply.
+    """
+
+
+class ArmTimeout(ArmError):
+    """
+    The arduino did not acknowledge a command within ackDeadline.
+    """
+
+
+class AsyncArm:
+    """
+    asyncio client for the arm that owns its own serial port.
+    A reader task parses replies and completes the future of the command each one acknowledges,
+    so the event loop keeps running while commands are outstanding.
+    Example : arm = AsyncArm(); await arm.open(); await arm.send("P2 -350"); await arm.close()
+    """
+    def __init__(self, port='/dev/ttyACM0', window=7):
+        self.port = port                        # Serial device of the arduino
+        self.uno = None                         # Serial connection, opened by open
+        self.window = asyncio.Semaphore(window) # Commands allowed in flight, 7 x 9 bytes fits the 64 byte buffer
+        self.pending = {}                       # Sequence number -> (future waiting for its ack, gCode, time sent)
+        self.readable = asyncio.Event()         # Set by the event loop when the port has data
+        self.buffer = bytearray()               # Bytes of an unfinished reply line
+        self.reader = None                      # Reader task
+        self.ready = asyncio.Event()            # Set once the sketch's ready banner arrives
+        self.boardVersion = None                # Frame version from the banner
+
+    async def open(self, deadline=3.0, wait=None):
+        # Opens the serial port, starts the reader task and waits for the sketch's ready banner
+        # Inputs  : deadline - longest wait in seconds for the banner
+        #           wait     - longest wait in seconds for the board to appear, connectWait if not given
+        # Outputs : none
+        # Raises  : ArmError - the board could not be opened within wait
+        wait = connectWait if wait is None else wait
+        end = None if wait is None else time.monotonic() + wait
+        delay = reconnectDelay                                  # Backoff between failed opens
+        warned = False                                          # Only complain once
+        while True:                                             # Loop until the connection has been established
+            try:
+                self.uno = ser.Serial(self.port, 115200, timeout=0)     # Non-blocking reads
+                break
+            except (ser.SerialException, OSError):
+                if not warned:
+                    print("ERROR : The arudino is not connected to the Pi. Attempting to reconnect...")
+                    warned = True
+            remaining = None if end is None else end - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise ArmError("No arduino on " + self.port + " after " + str(wait) + " s")
+            if os.path.exists(self.port):                           # There but not ready (udev still setting it up)
+                await asyncio.sleep(delay if remaining is None else min(delay, remaining))
+                delay = min(delay * 2, reconnectDelayMax)
+            else:                                                   # Unplugged, wait for the kernel without blocking the loop
+                await asyncio.get_running_loop().run_in_executor(None, waitForDevice, self.port, remaining)
+        asyncio.get_running_loop().add_reader(self.uno.fileno(), self.readable.set)
+        self.reader = asyncio.create_task(self.readLoop())
+        try:
+            await asyncio.wait_for(self.ready.wait(), deadline)  # Opening the port resets the board
+        except asyncio.TimeoutError:
+            print("WARNING : No ready banner from the arduino, it may be running an older sketch")
+        print("--- Arduino Connection Is Established ---")
+
+    async def readLoop(self):
+        # Reader task, splits incoming bytes into lines and hands them to handleLine
+        # Inputs  : none
+        # Outputs : none
+        try:
+            while True:
+                await self.readable.wait()
+                self.readable.clear()
+                self.buffer += self.uno.read(self.uno.in_waiting or 1)
+                while b'\n' in self.buffer:
+                    end = self.buffer.index(b'\n')
+                    line = self.buffer[:end].rstrip(b'\r').decode('latin-1')
+                    del self.buffer[:end + 1]
+                    self.handleLine(line)
+        except Exception as error:                      # Unplugged or port closed, nothing will be answered now
+            print("Arduino is no longer connected !!!")
+            asyncio.get_running_loop().remove_reader(self.uno.fileno())
+            for future, gCode, sentAt in self.pending.values():
+                if not future.done():
+                    future.set_exception(ArmError("Serial link lost: " + repr(error)))
+            self.pending = {}
+
+    def handleLine(self, line):
+        # Completes the future of the command a reply acknowledges
+        # Inputs  : line - one reply from the arduino
+        # Outputs : none
+        print("Arduino: " + line)
+        if line.startswith(readyBanner):                # Sketch is up
+            self.boardVersion = parseBanner(line)
+            self.ready.set()
+        ack = parseAck(line)
+        waiting = self.pending.pop(ack[0], None) if ack else None
+        if waiting and not waiting[0].done():           # Still wanted, so it is a real round trip
+            future, gCode, sentAt = waiting
+            if ack[2]:
+                recordLatency(gCode, time.perf_counter() - sentAt)
+                future.set_result(ack[1])
+            else:
+                future.set_exception(ArmError(gCode + " was rejected: " + ack[1]))
+
+    async def send(self, gCode):
+        # Sends a command and waits for its acknowledgement without blocking the event loop
+        # Inputs  : gCode - command for the arm
+        # Outputs : reply - the arduino's decoded copy of the command
+        # Raises  : ArmTimeout - no ack within ackDeadline, ArmError - rejected or the link is gone
+        async with self.window:                         # Wait for room in the arduino's buffer
+            if self.reader is None or self.reader.done():   # Nobody would read the ack
+                raise ArmError("The serial link to the arduino is closed")
+            seq = takeSeq()
+            future = asyncio.get_running_loop().create_future()
+            sentAt = time.perf_counter()
+            self.pending[seq] = (future, gCode, sentAt)
+            try:
+                self.uno.write(encodeSequenced(gCode, seq))
+                return await asyncio.wait_for(future, ackDeadline)
+            except asyncio.TimeoutError:
+                countTimeout()
+                raise ArmTimeout(gCode + " was not acknowledged within " + str(ackDeadline) + " s")
+            except (ser.SerialException, OSError) as error:    # Never sent
+                raise ArmError("Could not send " + gCode + ": " + repr(error))
+            finally:
+                self.pending.pop(seq, None)
+
+    async def close(self):
+        # Stops the reader task and closes the serial port
+        # Inputs  : none
+        # Outputs : none
+        if self.reader:
+            asyncio.get_running_loop().remove_reader(self.uno.fileno())
+            self.reader.cancel()
+            self.reader = None
+        for future, gCode, sentAt in self.pending.values():     # Nothing will answer these now
+            future.cancel()
+        self.pending = {}
+        self.uno.close()
+
+
+def startReader():
+    # Starts the reader thread so callers no longer read the port themselves
+    # Inputs  : none
+    # Outputs : none
+    # Globals : reader, readerRunning - Reader thread and its run flag
+
+    global reader, readerRunning
+
+    if reader is None:
+        readerRunning = True
+        reader = threading.Thread(target=readLoop, name="armReader", daemon=True)
+        reader.start()
+
+
+def stopReader():
+    # Stops the reader thread and cancels futures that will never be answered
+    # Inputs  : none
+    # Outputs : none
+    # Globals : reader, readerRunning - Reader thread and its run flag
+
+    global reader, readerRunning
+
+    if reader is not None:
+        readerRunning = False
+        reader.join()
+        reader = None
+    with futuresLock:
+        for future, gCode, sentAt in futures.values():
+            future.cancel()
+        futures.clear()
+
+
+def readLoop():
+    # Reader thread, completes the Future a reply acknowledges and queues every other reply
+    # Inputs  : none
+    # Outputs : none
+    # Globals : uno - Holds the serial connection to the arduino
+
+    while readerRunning:
+        expireFutures()
+        try:
+            line = readPort(min(0.5, ackDeadline / 2))      # Wakes up to check readerRunning and deadlines
+        except (ser.SerialException, OSError, TypeError, ValueError):   # Port closed or being reconnected
+            time.sleep(0.1)
+            continue
+        if line is None:                                    # Nothing arrived
+            continue
+        try:
+            ack = parseAck(line)
+            with futuresLock:
+                waiting = futures.pop(ack[0], None) if ack else None
+                late = waiting is None and ack is not None and ack[0] in lateSeqs
+                if late:
+                    lateSeqs.discard(ack[0])
+            if late:                                            # Its future already timed out or was cancelled
+                print("Arduino (too late): " + line)
+                continue
+            if waiting is None:                                 # Nobody is waiting, leave it for readLine
+                keepLine(line)
+                continue
+            print("Arduino: " + line)
+            future, gCode, sentAt = waiting
+            if future.done():                                   # Cancelled or timed out, the ack came too late
+                continue
+            if ack[2]:                                          # Only real round trips go in the histograms
+                recordLatency(gCode, time.perf_counter() - sentAt)
+                future.set_result(ack[1])
+            else:
+                future.set_exception(ArmError(gCode + " was rejected: " + ack[1]))
+        except concurrent.futures.InvalidStateError:        # Cancelled after the check above
+            pass
+        except Exception as error:                          # Keep reading, every later command depends on it
+            print("WARNING : Reader thread could not handle " + repr(line) + ": " + repr(error))
+
+
+def keepLine(line):
+    # Queues a reply for readLine, dropping the oldest one if nobody has been reading them
+    # Inputs  : line - reply without its line ending
+    # Outputs : none
+    # Globals : readerQueue - Replies no future was waiting for
+
+    while True:
+        try:
+            readerQueue.put_nowait(line)
+            return
+        except queue.Full:
+            try:
+                readerQueue.get_nowait()
+            except queue.Empty:                         # A reader took one meanwhile
+                pass
+
+
+def expireFutures():
+    # Fails the futures whose ack is more than ackDeadline overdue, which frees their room in the window
+    # Inputs  : none
+    # Outputs : none
+    # Globals : futures - Futures waiting for their ack
+
+    now = time.perf_counter()
+    with futuresLock:
+        overdue = [seq for seq, (future, gCode, sentAt) in futures.items() if now - sentAt > ackDeadline]
+        expired = [futures.pop(seq) for seq in overdue]
+        lateSeqs.update(overdue)
+    for future, gCode, sentAt in expired:
+        try:
+            future.set_exception(ArmTimeout(gCode + " was not acknowledged within " + str(ackDeadline) + " s"))
+        except concurrent.futures.InvalidStateError:    # Already cancelled by its caller
+            continue
+        countTimeout()
+
+
+def dropFuture(future):
+    # Forgets a future nobody waits for any more, so a late ack is not matched to it
+    # Inputs  : future - Future returned by tellArmFuture
+    # Outputs : none
+    # Globals : futures - Futures waiting for their ack
+
+    with futuresLock:
+        for seq in [seq for seq, waiting in futures.items() if waiting[0] is future]:
+            del futures[seq]
+            lateSeqs.add(seq)
+
+
+def tellArmFuture(gCode):
+    # Sends a command without waiting for the reply, starting the reader thread if needed
+    # Inputs  : gCode - command for the arm
+    # Outputs : future - concurrent.futures.Future, result() is the arduino's decoded copy of the command
+    # Globals : uno - Holds the serial connection to the arduino
+    # Example : done = tellArmFuture("P2 -350") ... done.result()
+    # Raises  : ArmTimeout - no room in the window within ackDeadline, result() raises it for a lost ack
+    #           result() raises ArmError if the command could not be sent
+
+    startReader()
+    if not futuresWindow.acquire(timeout=ackDeadline):  # Wait for room in the arduino's buffer
+        countTimeout()
+        raise ArmTimeout("No room for " + gCode + ", " + str(len(futures)) + " commands are still unacknowledged")
+    future = concurrent.futures.Future()
+    sentAt = time.perf_counter()
+    future.add_done_callback(lambda finished: futuresWindow.release())
+    seq = takeSeq()
+    with futuresLock:
+        futures[seq] = (future, gCode, sentAt)
+    try:
+        uno.write(encodeSequenced(gCode, seq))
+    except (ser.SerialException, OSError) as error:     # Never sent, so never answered
+        with futuresLock:
+            futures.pop(seq, None)
+        print("Arduino is no longer connected !!!")     # Warn about a disconnection if transmittion fails
+        future.set_exception(ArmError("Could not send " + gCode + ": " + repr(error)))
+        try:
+            connect(wait=reconnectWait)                 # Attempt to reconnect to arduino for the next command
+        except ArmError as failure:
+            print("WARNING : " + str(failure))
+    return future
+
+
+def readGCode(source):
+    # Yields one command at a time, so a program of any length uses constant memory
+    # Inputs  : source - file name, open file or any iterable of G-Code lines
+    # Outputs : commands - generator of G-Code strings, blank lines and ";" comments removed
+    # Globals : none
+
+    if isinstance(source, str):                     # File name
+        with open(source) as f:
+            yield from readGCode(f)
+        return
+    for line in source:
+        line = line.split(';')[0].strip()               # Drop comments
+        if line:
+            yield line
+
+
+def streamGCode(source, lookahead=16, credits=rxBuffer):
+    # Sends a whole G-Code program as fast as the arduino can take it
+    # Every byte sent spends a credit and every acknowledgement returns the bytes of its command,
+    # so the arduino's receive buffer is kept as full as possible without ever overflowing
+    # Inputs  : source    - file name, open file or iterable of G-Code lines
+    #           lookahead - commands parsed and encoded ahead of the link
+    #           credits   - bytes the arduino can buffer
+    # Outputs : rejected - commands the arduino answered with an error
+    # Globals : uno - Holds the serial connection to the arduino
+    # Example : streamGCode("wave.gcode")
+    # Raises  : ArmTimeout - no ack for ackDeadline
+
+    commands = readGCode(source)
+    ahead = collections.deque()                     # (seq, bytes, gCode) ready to send
+    inFlight = {}                                   # Sequence number -> (credits used, gCode, send time)
+    rejected = []
+    sent = 0
+    lastAck = time.monotonic()                      # Time of the last ack
+    while True:
+        while len(ahead) < lookahead:                   # Keep the lookahead full
+            gCode = next(commands, None)
+            if gCode is None:                               # End of the program
+                break
+            seq = takeSeq()
+            ahead.append((seq, encodeSequenced(gCode, seq), gCode))
+        while ahead and len(ahead[0][1]) <= credits:    # Send while there is credit
+            seq, data, gCode = ahead.popleft()
+            uno.write(data)
+            credits -= len(data)
+            inFlight[seq] = (len(data), gCode, time.perf_counter())
+            sent += 1
+        if not inFlight:                                # Nothing out and nothing left to send
+            break
+        line = readLine(lastAck + ackDeadline - time.monotonic())     # Out of credit, wait for an ack
+        ack = parseAck(line) if line else None
+        if line is None:
+            countTimeout()
+            raise ArmTimeout(str(len(inFlight)) + " streamed commands were not acknowledged after " + str(sent))
+        if ack and ack[0] in inFlight:
+            lastAck = time.monotonic()
+            used, gCode, sentAt = inFlight.pop(ack[0])
+            credits += used                                 # Its bytes have left the arduino's buffer
+            if ack[2]:
+                recordLatency(gCode, time.perf_counter() - sentAt)
+            else:
+                print("Arduino rejected " + gCode + ": " + ack[1])
+                rejected.append(gCode)
+    print("Arduino: streamed " + str(sent) + " commands")
+    return rejected
+
+
+class SerialDevice:
+    """
+    One serial link with its own worker thread, so a slow device only ever delays its own commands.
+    Example : arm = SerialDevice("arm", "/dev/ttyACM0", readyBanner); arm.submit(b"129350").result()
+    """
+    def __init__(self, role, port, banner=None, deadline=3.0):
+        self.role = role                    # Job of the board, e.g. "arm"
+        self.port = port                    # Serial device
+        self.link = ser.Serial(port, 115200, timeout=0.1)
+        self.worker = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix=role)
+        if banner:                          # Opening the port resets the board, wait for it
+            self.worker.submit(self.waitFor, banner, deadline)
+
+    def waitFor(self, banner, deadline):
+        # Reads until a line starting with banner arrives or the deadline passes
+        # Inputs  : banner   - start of the line to wait for
+        #           deadline - longest wait in seconds
+        # Outputs : found - True if the banner arrived
+        end = time.monotonic() + deadline
+        while time.monotonic() < end:
+            if self.link.readline().decode('latin-1').startswith(banner):
+                return True
+        print("WARNING : No ready banner from the " + self.role + " board")
+        return False
+
+    def exchange(self, data, replies=1, deadline=2.0):
+        # Writes data and reads the replies to it, runs on the worker thread
+        # Inputs  : data     - bytes to send
+        #           replies  - reply lines to collect
+        #           deadline - longest wait in seconds for all of them
+        # Outputs : lines - replies without line endings, fewer than asked for if the deadline passed
+        self.link.write(data)
+        lines = []
+        end = time.monotonic() + deadline
+        while len(lines) < replies:
+            if time.monotonic() > end:
+                countTimeout()
+                print("WARNING : The " + self.role + " board did not answer in time")
+                break
+            line = self.link.readline()
+            if line:
+                lines.append(line.rstrip(b'\r\n').decode('latin-1'))
+        return lines
+
+    def submit(self, data, replies=1, deadline=2.0):
+        # Queues an exchange on this device's worker thread
+        # Inputs  : data, replies, deadline - see exchange
+        # Outputs : future - concurrent.futures.Future, result() is the list of reply lines
+        return self.worker.submit(self.exchange, data, replies, deadline)
+
+    def close(self):
+        # Finishes queued exchanges and closes the port
+        # Inputs  : none
+        # Outputs : none
+        self.worker.shutdown(wait=True)
+        self.link.close()
+
+
+class DeviceManager:
+    """
+    Owns a SerialDevice per role and sends to all of them in parallel.
+    Example : boards = DeviceManager(); boards.discover(); boards.sendAll({"arm": b"129350", "drive": b"..."})
+    """
+    def __init__(self):
+        self.devices = {}                   # Role -> SerialDevice
+
+    def discover(self, ids=None, folder="/dev/serial/by-id"):
+        # Opens every board whose by-id name contains its role's id
+        # Inputs  : ids    - role -> id text, deviceIds if not given
+        #           folder - where udev lists serial devices by id
+        # Outputs : found - role -> by-id path of every board that was opened
+        found = {}
+        names = sorted(glob.glob(os.path.join(folder, "*")))
+        for role, boardId in (ids or deviceIds).items():
+            matches = [name for name in names if boardId in os.path.basename(name)]
+            if not matches:
+                print("WARNING : No " + role + " board matching '" + boardId + "' in " + folder)
+                continue
+            if len(matches) > 1:
+                print("WARNING : Several boards match '" + boardId + "', using " + matches[0])
+            try:
+                self.add(role, matches[0])
+            except (ser.SerialException, OSError) as error:    # Busy or no permission, still open the others
+                print("WARNING : Could not open the " + role + " board " + matches[0] + ": " + str(error))
+                continue
+            found[role] = matches[0]
+        return found
+
+    def add(self, role, port):
+        # Opens one board, waiting for the simpleGCode banner if it is the arm
+        # Inputs  : role - job of the board
+        #           port - serial device
+        # Outputs : none
+        if role in self.devices:
+            self.devices[role].close()
+        self.devices[role] = SerialDevice(role, port, readyBanner if role == "arm" else None)
+
+    def send(self, role, data, replies=1, deadline=2.0):
+        # Sends to one board without waiting for it
+        # Inputs  : role - board to send to, other inputs as SerialDevice.exchange
+        # Outputs : future - result() is the list of reply lines
+        return self.devices[role].submit(data, replies, deadline)
+
+    def sendAll(self, commands, replies=1, deadline=2.0):
+        # Sends to several boards at once, each on its own thread
+        # Inputs  : commands - role -> bytes, other inputs as SerialDevice.exchange
+        # Outputs : futures - role -> future of its reply lines
+        return {role: self.send(role, data, replies, deadline) for role, data in commands.items()}
+
+    def tellArm(self, gCode):
+        # Sends one G-Code command to the arm board
+        # Inputs  : gCode - command for the arm
+        # Outputs : future - result() is the arduino's reply lines
+        return self.send("arm", gCode2num(gCode).encode())
+
+    def close(self):
+        # Closes every board
+        # Inputs  : none
+        # Outputs : none
+        for device in self.devices.values():
+            device.close()
+        self.devices = {}
+
+
+class SetpointQueue:
+    """
+    Outbound queue for interactive arm control. A setpoint (see coalescable) replaces the one still
+    waiting for the same letter and joint, so the backlog never grows past one per joint.
+    Any other command is sent exactly as queued, and setpoints queued after it are never sent before it.
+    Example : arm = SetpointQueue(); arm.put("P2 -350"); ... arm.close()
+    """
+    def __init__(self, send=None):
+        self.send = send or tellArm         # Sends one command and waits for it
+        self.entries = collections.deque()  # [gCode, key] waiting to be sent, oldest first
+        self.latest = {}                    # (letter, joint) -> its waiting entry, cleared by other commands
+        self.replaced = 0                   # Setpoints dropped for a newer value
+        self.failed = 0                     # Commands the arduino rejected or never acknowledged
+        self.running = True
+        self.condition = threading.Condition()
+        self.worker = threading.Thread(target=self.run, name="setpoints", daemon=True)
+        self.worker.start()
+
+    def put(self, gCode):
+        # Queues a command, replacing the waiting setpoint for the same joint if there is one
+        # Inputs  : gCode - command for the arm
+        # Outputs : none
+        # Raises  : ArmError - close was called, the command would never be sent
+        compact = gCode.replace(" ", "")
+        key = (compact[:1], compact[1:2])
+        with self.condition:
+            if not self.running:
+                raise ArmError("The setpoint queue is closed, " + gCode + " was not queued")
+            if key[0] in coalescable:
+                entry = self.latest.get(key)
+                if entry:                               # Last write wins
+                    entry[0] = gCode
+                    self.replaced += 1
+                    return
+                entry = self.latest[key] = [gCode, key]
+            else:                                       # Later setpoints must queue behind this one
+                entry = [gCode, None]
+                self.latest.clear()
+            self.entries.append(entry)
+            self.condition.notify()
+
+    def pending(self):
+        # Commands waiting to be sent
+        return len(self.entries)
+
+    def run(self):
+        # Worker thread, sends the oldest waiting command
+        # Inputs  : none
+        # Outputs : none
+        while True:
+            with self.condition:
+                while not self.entries and self.running:
+                    self.condition.wait()
+                if not self.entries:                    # Closed and empty
+                    return
+                entry = self.entries.popleft()
+                if self.latest.get(entry[1]) is entry:  # Being sent now, a new value needs a new entry
+                    del self.latest[entry[1]]
+            try:
+                self.send(entry[0])
+            except (ArmError, ser.SerialException, OSError) as error:   # Lost, rejected or unplugged, keep the queue moving
+                self.failed += 1
+                print("WARNING : " + entry[0] + " failed: " + str(error))
+
+    def close(self):
+        # Sends everything still waiting and stops the worker thread
+        # Inputs  : none
+        # Outputs : none
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.worker.join()
 
 
 def exit():
@@ -96,6 +1147,8 @@ def exit():
 
     global uno                  # Calls the arduino communication variable
 
+    flushBatch()                # Send anything tellArm is still holding
+    stopReader()                # Give the port back before closing it
     print("----------------------------")  # Ending display
     try:
         time.sleep(0.5)         # Let arduino disable pins
@@ -138,3 +1191,207 @@ def gCode2num(inputString):
         comCode = "000000"
 
     return comCode
+
+
+def parseGCode(gCode):
+    # Splits a G-Code string into its parts
+    # Inputs  : gCode - command such as "P2 -350"
+    # Outputs : (letter, joint, value) - ("P", 2, -350)
+    # Globals : none
+
+    gCode = gCode.replace(" ", "")
+    return (gCode[0], int(gCode[1]), int(gCode[2:]) if len(gCode) > 2 else 0)
+
+
+def encodeFrame(commands, seq):
+    # Packs commands straight into one frame buffer, no strings are built on the way
+    # Inputs  : commands - list of (letter, joint, value), at most frameLimit of them
+    #           seq      - sequence number of the first command, the rest follow on
+    # Outputs : frame - memoryview of the frame, ready for uno.write
+    # Globals : none
+    # Example : encodeFrame([("P", 2, -350)], 0) - a 9 byte frame
+    # Raises  : ValueError - a joint outside 0-255 or a value outside -32768 to 32767
+
+    length = len(commands) * frameCommand.size
+    frame = bytearray(frameHeader.size + length + 1)        # The only allocation
+    frameHeader.pack_into(frame, 0, frameSync, frameVersion, seq, length)
+    offset = frameHeader.size
+    for letter, joint, value in commands:
+        try:
+            frameCommand.pack_into(frame, offset, letterCodes.get(letter, 0), joint, value)
+        except struct.error:                                # Does not fit a byte joint and int16 value
+            raise ValueError("%s%s %s does not fit a binary frame" % (letter, joint, value)) from None
+        offset += frameCommand.size
+    crc = 0
+    for byte in memoryview(frame)[1:offset]:                # Everything after the sync byte
+        crc = crcTable[crc ^ byte]
+    frame[offset] = crc
+    return memoryview(frame)
+
+
+def decodeFrame(frame):
+    # Unpacks a frame the same way simpleGCode.ino does
+    # Inputs  : frame - bytes of one frame
+    # Outputs : seq      - sequence number of the first command
+    #           commands - list of (letter, joint, value), letter is "" for unknown codes
+    # Globals : none
+
+    frame = memoryview(frame)
+    sync, version, seq, length = frameHeader.unpack_from(frame)
+    if sync != frameSync or version != frameVersion:
+        raise ValueError("ERR version")
+    if length % frameCommand.size or len(frame) != frameHeader.size + length + 1:
+        raise ValueError("ERR length")
+    crc = 0
+    for byte in frame[1:-1]:
+        crc = crcTable[crc ^ byte]
+    if crc != frame[-1]:
+        raise ValueError("ERR crc")
+    commands = [(codeLetters.get(code, ""), joint, value)
+                for code, joint, value in frameCommand.iter_unpack(frame[frameHeader.size:-1])]
+    return seq, commands
+
+
+def encodeSequenced(gCode, seq):
+    # Encodes one command so the arduino answers it with "#ss <gcode>"
+    # Inputs  : gCode - command for the arm
+    #           seq   - sequence number, 0-255
+    # Outputs : data - bytes for uno.write in the active protocol
+    # Globals : protocol - "ascii" or "binary"
+
+    if protocol == "binary":
+        return encodeFrame([parseGCode(gCode)], seq)
+    return ("#%02X" % seq + gCode2num(gCode)).encode()
+
+
+def parseAck(line):
+    # Splits a sequenced reply from the arduino
+    # Inputs  : line - reply without its line ending
+    # Outputs : (seq, text, ok) - ok is False for "!" rejections, None if the line is not sequenced
+    # Globals : none
+
+    if line[:1] not in ('#', '!') or len(line) < 4:
+        return None
+    try:
+        seq = int(line[1:3], 16)
+    except ValueError:                                  # Garbled sequence number
+        return None
+    return (seq, line[4:], line[0] == '#')
+
+
+def encodeMany(letters, joints, values):
+    # Vectorized gCode2num, gives exactly the same six characters for every command
+    # Inputs  : letters - array of command letters ("P", "S", ...), anything else encodes as "000000"
+    #           joints  - array of joint digits 0-9
+    #           values  - array of values, -999 to 9999 like the four digit field allows
+    # Outputs : codes - (n, 6) uint8 array of ASCII digits, codes.tobytes() is ready for uno.write
+    # Globals : letterCodes - Letter to command digit
+    # Example : encodeMany(["P", "Q"], [2, 7], [-350, 443]).tobytes() - b"129350370443"
+
+    import numpy as np      # Only needed for bulk trajectory work
+
+    letters = np.asarray(letters, dtype='S1').view(np.uint8).reshape(-1)
+    joints = np.asarray(joints, dtype=np.int64).reshape(-1)
+    values = np.asarray(values, dtype=np.int64).reshape(-1)
+    if values.size and (values.min() < -999 or values.max() > 9999):
+        raise ValueError("gCode2num values must be between -999 and 9999")
+    table = np.zeros(256, dtype=np.uint8)                   # Letter byte -> command digit, 0 if unknown
+    for letter, code in letterCodes.items():
+        table[ord(letter)] = code
+    digit = table[letters]
+
+    magnitude = np.abs(values)
+    codes = np.empty((values.size, 6), dtype=np.uint8)
+    codes[:, 0] = digit + ord('0')
+    codes[:, 1] = joints + ord('0')
+    codes[:, 2] = np.where(values < 0, ord('9'), magnitude // 1000 + ord('0'))     # '%04d' sign, '-' sent as '9'
+    codes[:, 3] = magnitude // 100 % 10 + ord('0')
+    codes[:, 4] = magnitude // 10 % 10 + ord('0')
+    codes[:, 5] = magnitude % 10 + ord('0')
+    codes[digit == 0] = ord('0')                            # Unknown letters become "000000"
+    return codes
+
+
+def decodeMany(codes):
+    # Vectorized num2gCode from simpleGCode.ino, including how it reads every '9' as '-' before toInt
+    # Inputs  : codes - bytes of back to back six character codes, or an (n, 6) uint8 array
+    # Outputs : letters - array of letters, "" for unknown command digits
+    #           joints  - array of joint digits
+    #           values  - array of the values the arduino ends up with
+    # Globals : codeLetters - Command digit to letter
+
+    import numpy as np      # Only needed for bulk trajectory work
+
+    if isinstance(codes, (bytes, bytearray, memoryview)):
+        codes = np.frombuffer(codes, dtype=np.uint8)
+    codes = np.asarray(codes, dtype=np.uint8).reshape(-1, 6)
+    table = np.array([''] + [codeLetters[code] for code in range(1, 9)] + [''] * 247)
+    letters = table[codes[:, 0] - ord('0')]
+    joints = codes[:, 1].astype(np.int64) - ord('0')
+
+    number = codes[:, 2:]                                   # The four digit field
+    digits = number.astype(np.int64) - ord('0')
+    isDigit = (number >= ord('0')) & (number <= ord('8'))   # '9' was turned into '-'
+    negative = number[:, 0] == ord('9')                     # toInt accepts one leading '-'
+    isDigit[negative, 0] = True                                 # Skip it without stopping the number
+    counted = np.cumprod(isDigit, axis=1).astype(bool)      # toInt stops at the first non-digit
+    counted[negative, 0] = False
+    values = np.zeros(len(codes), dtype=np.int64)
+    for i in range(4):
+        values = np.where(counted[:, i], values * 10 + digits[:, i], values)
+    values = np.where(negative, -values, values)
+    return letters, joints, values
+
+
+def recordLatency(gCode, seconds):
+    # Adds one send-to-ack time to the histogram of the command's letter
+    # Inputs  : gCode   - command that was acknowledged
+    #           seconds - time from sending it to its ack
+    # Outputs : none
+    # Globals : latencyCounts - Histogram per letter
+
+    letter = gCode.lstrip()[:1]
+    bucket = bisect.bisect_left(latencyBuckets, seconds)
+    with statsLock:
+        counts = latencyCounts.get(letter)
+        if counts is None:                              # First command with this letter
+            counts = latencyCounts[letter] = [0] * len(latencyBuckets)
+        counts[bucket] += 1
+
+
+def latencySnapshot():
+    # Copies the link statistics so far
+    # Inputs  : none
+    # Outputs : snapshot - {"reconnects": n, "timeouts": n, "letters": {letter: {"count", "p50", "p95", "p99", "buckets"}}}
+    #                      percentiles are the upper edge of the bucket they fall in, in seconds
+    # Globals : latencyCounts, reconnects, timeouts - Link statistics
+
+    with statsLock:
+        letters = {letter: list(counts) for letter, counts in latencyCounts.items()}
+        snapshot = {"reconnects": reconnects, "timeouts": timeouts, "letters": {}}
+    for letter, counts in letters.items():
+        total = sum(counts)
+        summary = {"count": total, "buckets": list(zip(latencyBuckets, counts))}
+        for name, fraction in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99)):
+            running = 0
+            for edge, count in zip(latencyBuckets, counts):
+                running += count
+                if running >= fraction * total:
+                    summary[name] = edge
+                    break
+        snapshot["letters"][letter] = summary
+    return snapshot
+
+
+def resetLatency():
+    # Clears the histograms and counters
+    # Inputs  : none
+    # Outputs : none
+    # Globals : latencyCounts, reconnects, timeouts - Link statistics
+
+    global reconnects, timeouts
+
+    with statsLock:
+        latencyCounts.clear()
+        reconnects = 0
+        timeouts = 0
@@ -18,15 +18,23 @@ import atexit               # "At Exit" module for when code is terminated
 import signal               # Used to control keyboard interrupt
 import threading            # Imporves GPIO settings
 import math                 # Used for math stuffs
+import startup              # Custom Module that waits for the pi to be ready at boot
 
-if os.environ.get('TERM') != 'xterm-256color':      # Checks that code is run at startup
-    time.sleep(10)                                  # Add a pause for everything to catchup
- 
-os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = 'hide'       # Disable pygame welcome message
-import pygame               # Interfaces with xbox controller
+startupReady = startup.waitForAll()                 # Wait only until GPIO, a joystick and the log folder are up
+startup.mark("resources checked")
+
+if os.environ.get('ROVER_INPUT') == 'evdev':        # Read the controller straight from /dev/input
+    import evdevInput as pygame                         # Same calls as the parts of pygame used here
+else:
+    os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = 'hide'       # Disable pygame welcome message
+    import pygame               # Interfaces with xbox controller
 import RPi.GPIO as GPIO     # Used for controlling the motors from the pi
+startup.mark("input backend and GPIO imported")
 
 import fancy                # Custom Module used for formatted printing
+import telemetry            # Custom Module that records events to a binary ring buffer
+import inputLog             # Custom Module that records and replays controller events
+from scheduler import RateScheduler     # Custom Module that paces the main loop
 ### End imports ###
 
 #%% Start Formatting ###
@@ -44,6 +52,10 @@ os.putenv('SDL_VIDEODRIVER', 'dummy')       # Disable digital display
     # wait4XboxController   - Loop that runs until the xbox controller has been connected
     # getController         - Used to output the xbox controller to the rest of the script
     # receiveXboxSignals    - Process data sent from the xbox controller
+    # handleEvent           - Records and runs one controller event
+    # controllerRemoved     - Stops the motors the moment the controller disappears
+    # controllerAdded       - Binds a newly plugged in controller
+    # axisEvent             - Drives the motors from one joystick axis event
     # calcDutyCycle         - Converts [-1, 1] range to duty cycle
     # buttonPressEvent      - Command for button presses
     # duoControlsFront      - Primary controls for forward motion
@@ -59,9 +71,30 @@ os.putenv('SDL_VIDEODRIVER', 'dummy')       # Disable digital display
 #           inReverse   - Boolean for the controls being inverted
 #           aPresses    - Tracks timestamps of "A" button presses
 #           slowMode    - Boolean for half speed mode
+#           coalesceAxes  - Only the newest value of each axis is acted on per pass
+#           skippedAxes   - Axis events replaced by a newer one before they were acted on
+#           controlRate   - Passes per second of the main loop
+#           loop          - RateScheduler pacing the main loop
+#           idleAfter     - Seconds without input before the main loop blocks waiting for an event
+#           inputLatency  - Seconds from the input that ended each idle wait to the motors being updated,
+#                           from the kernel's event time with evdev and from the wake-up with pygame (no event time)
+#           controller    - Joystick being driven from, None while disconnected
+#           removedAt     - Time the controller was unplugged
+#           drainedAt     - Time the events being handled were taken off the queue
 
 global rgb, inReverse, aPresses, slowMode
 
+coalesceAxes = os.environ.get('ROVER_COALESCE', '1') != '0'    # ROVER_COALESCE=0 handles every event
+skippedAxes = 0
+controlRate = float(os.environ.get('ROVER_CONTROL_RATE', '50'))  # Hz, input sampling and actuation rate
+loop = None
+idleAfter = float(os.environ.get('ROVER_IDLE_AFTER', '2'))      # 0 never idles
+idleTimeout = 1000                  # Longest idle wait in ms
+inputLatency = []
+controller = None
+removedAt = 0
+drainedAt = 0
+
 #%% Start Input Programs ###
 
 
@@ -83,11 +116,11 @@ def presetInputProgram():
             i = 0                   # Overwrite for a constant off duty cycle
             while currMotor > 0:
                 dutyLeft = calcDutyCycle(i)         # Calculate duty cycle
-                print("Python: Set the duty percentage to {}.".format(dutyLeft))    # Tell user what the pi is telling arduino
+                fancy.debug("Python: Set the duty percentage to %s.", dutyLeft)    # Tell user what the pi is telling arduino
                 setDuty(currMotor+3, 20)         # Set duty cycle
                 currMotor = currMotor - 1
                 time.sleep(2)
-                print(" ")
+                fancy.debug(" ")
 
 
 def manualInputs():
@@ -122,14 +155,14 @@ def wait4XboxController():
     
     # If no joysticks are connected, wait for one to be added
     while True:
-        for event in pygame.event.get():            # Handle pygame events
-            if event.type == pygame.JOYDEVICEADDED:   # If a joystick is connected
-                controller = pygame.joystick.Joystick(0) # Create controller variable
-                controller.init()                   # Initialize controller
-                fancy.Print("The {} is connected".format(controller.get_name()))
-                return controller                   # Return the initialized controller object
-        print("Retrying controller connection...")   # Take a guess...
-        time.sleep(2)                                # Two-second delay
+        event = pygame.event.wait(2000)             # Sleep until a pygame event, for two seconds at most
+        if event.type == pygame.JOYDEVICEADDED:     # If a joystick is connected
+            controller = pygame.joystick.Joystick(event.device_index)  # Create controller variable
+            controller.init()                       # Initialize controller
+            fancy.Print("The {} is connected".format(controller.get_name()))
+            return controller                       # Return the initialized controller object
+        if event.type == pygame.NOEVENT:            # Nothing for two seconds
+            print("Retrying controller connection...")   # Take a guess...
 
 
 def getController():
@@ -150,7 +183,8 @@ def getController():
     time.sleep(1)                           # Delay to highlight red light
     controller = wait4XboxController()      # Waits until controller is connected
     pygame.event.set_blocked(None)          # Set up the event queue
-    pygame.event.set_allowed([pygame.JOYBUTTONDOWN, pygame.JOYAXISMOTION, pygame.QUIT])
+    pygame.event.set_allowed([pygame.JOYBUTTONDOWN, pygame.JOYAXISMOTION, pygame.QUIT,
+                              pygame.JOYDEVICEADDED, pygame.JOYDEVICEREMOVED])     # Hot-plug events
 
     # print(pygame.version.ver)
     # # set the vibration to full power for 1 second
@@ -163,24 +197,122 @@ def getController():
     return controller
 
 
-def receiveXboxSignals(cont):
+def receiveXboxSignals(cont, waiting=(), drain=True):
     # Function to direct all data from the x-box controller
-    # Inputs  : none
-    # Outputs : none
-    # Globals : inReverse - Boolean variable for the controls being inverted
+    # Inputs  : waiting - events already taken off the queue (by an idle wait or a replay), handled first
+    #           drain   - also handle everything on the pygame queue, False for a replay
+    # Outputs : count   - number of events handled
+    # Globals : coalesceAxes - Drain the queue and act on the newest value of each axis once per run of axis events
+    #           skippedAxes  - Counts the axis events that were overwritten
 
-    global inReverse
+    global skippedAxes, drainedAt
 
     # Check for joystick events
-    for event in pygame.event.get():
-        if event.type == pygame.JOYBUTTONDOWN:   # Code for button press  # NOTE: MAPPING NEEDS VERIFICATION
-            buttonPressEvent(event)
-        if event.type == pygame.JOYAXISMOTION:  # Code for joystick motion
-            if inReverse:        # Invert Controls
-                duoControlsBack(event)
-            else:                # Normal Controls
-                duoControlsFront(event)
-        time.sleep(0.001)
+    if not waiting:                         # An idle wait sets drainedAt when it takes its event
+        drainedAt = time.monotonic()
+    events = list(waiting) + (pygame.event.get() if drain else [])
+    inputLog.record(events)                 # Only while ROVER_RECORD is set
+    if not coalesceAxes:                    # Every event, one at a time
+        for event in events:
+            handleEvent(event)
+            time.sleep(0.001)
+        return len(events)
+
+    newest = {}                             # Newest event of each axis
+    for event in events:                    # Drain the queue
+        if event.type == pygame.JOYAXISMOTION:
+            telemetry.record(telemetry.AXIS, event.axis, event.value)
+            if event.axis in newest:                # An older position is now stale
+                skippedAxes += 1
+            newest[event.axis] = event
+        else:                                   # Buttons and hot-plug keep their order
+            for position in newest.values():        # Act on earlier positions with the modes they were read in
+                axisEvent(position)
+            newest.clear()
+            handleEvent(event)
+    for event in newest.values():           # One actuation per axis
+        axisEvent(event)
+    return len(events)
+
+
+def handleEvent(event):
+    # Function to record and act on one controller event
+    # Inputs  : event - pygame event
+    # Outputs : none
+    # Globals : none
+
+    if event.type == pygame.JOYBUTTONDOWN:   # Code for button press  # NOTE: MAPPING NEEDS VERIFICATION
+        telemetry.record(telemetry.BUTTON, event.button)
+        buttonPressEvent(event)
+    if event.type == pygame.JOYAXISMOTION:  # Code for joystick motion
+        telemetry.record(telemetry.AXIS, event.axis, event.value)
+        axisEvent(event)
+    if event.type == pygame.JOYDEVICEREMOVED:   # Controller unplugged or out of range
+        controllerRemoved(event)
+    if event.type == pygame.JOYDEVICEADDED:     # Controller plugged in
+        controllerAdded(event)
+
+
+def controllerRemoved(event):
+    # Function to stop the rover as soon as its controller disappears
+    # Inputs  : event - JOYDEVICEREMOVED event
+    # Outputs : none
+    # Globals : controller - Joystick being driven from
+    #           removedAt  - Time the controller was unplugged
+
+    global controller, removedAt
+
+    if controller is None or event.instance_id != controller.get_instance_id():   # Some other device
+        return
+    if hasattr(event, 'time'):              # evdev stamps the event when the unplug was seen
+        removedAt = time.monotonic() - (time.time() - event.time)
+    else:                                   # pygame does not, so start from when this pass took it off the queue
+        removedAt = drainedAt
+    for i in range(6):                      # For each motor
+        setDuty(i+1, 30)                        # Disable motor
+    neutral = time.monotonic() - removedAt
+    controller = None
+    rgb.setColor("red")                     # Set LEDs to red
+    fancy.Print("Controller Disconnected")
+    fancy.info("Motors neutral %.2f ms after the disconnect event", neutral * 1000)
+
+
+def controllerAdded(event):
+    # Function to drive from a controller that was just plugged in, resetting the modes like getController
+    # Inputs  : event - JOYDEVICEADDED event
+    # Outputs : none
+    # Globals : controller  - Joystick being driven from
+    #           inReverse   - Boolean for the controls being inverted
+    #           aPresses    - Tracks timestamps of "A" button presses
+    #           slowMode    - Boolean for half speed mode
+
+    global controller, inReverse, aPresses, slowMode
+
+    if controller is not None:              # Already driving from one (pygame also announces it at start)
+        return
+    controller = pygame.joystick.Joystick(event.device_index)
+    controller.init()
+    inReverse = 0                           # Disable reverse mode
+    aPresses = []                           # Tracks a Presses
+    slowMode = 0                            # Sets speed to full
+    rgb.setColor("green")                   # Set LEDs to green
+    fancy.Print("The {} is connected".format(controller.get_name()))
+    if removedAt:
+        fancy.info("Controller back %.0f ms after it was lost", (time.monotonic() - removedAt) * 1000)
+
+
+def axisEvent(event):
+    # Function to send one joystick axis event to the controls for the current facing
+    # Inputs  : event - event for the axis change
+    # Outputs : none
+    # Globals : inReverse - Boolean variable for the controls being inverted
+
+    if controller is None:  # Nothing to drive from, the motors stay neutral
+        return
+    if inReverse:        # Invert Controls
+        duoControlsBack(event)
+    else:                # Normal Controls
+        duoControlsFront(event)
 
 
 def calcDutyCycle(signal):
@@ -226,9 +358,10 @@ def buttonPressEvent(event):
     elif event.button == 0:  # "A" Button
         currentTime = time.time()               # Record time
         aPresses.append(currentTime)            # Add the press to the holder variable
-        print(aPresses)
+        if fancy.level <= fancy.DEBUG:           # Only copy the list when it will be logged
+            fancy.debug("%s", list(aPresses))        # A copy, later presses must not change the logged value
         if len(aPresses) >= 3:                   # If there have been least 3 clicks
-            print(currentTime - aPresses[-2])
+            fancy.debug("%s", currentTime - aPresses[-2])
             if currentTime - aPresses[-2] < 1:      # If the last three clicks all happened within one second
                 slowMode = not(slowMode)                # Swap slowmode
                 if slowMode:                       # Tells user about any changes
@@ -240,18 +373,18 @@ def buttonPressEvent(event):
                 aPresses = []                           # Clear a presses
         if len(aPresses) > 3:                 # Clear trailing timestamps
                 aPresses = aPresses[-2:]
-        print("button 0 down")
+        fancy.debug("button 0 down")
     elif event.button == 1:  # "B" Button
-        print("button 1 down")
+        fancy.debug("button 1 down")
     elif event.button == 2:  # 
-        print("button 2 down")
+        fancy.debug("button 2 down")
     elif event.button == 3:     # "X" Button
         # print("button 3 down")
         handleInterrupt(signal.SIGINT, None)     # Instantly kill script
     elif event.button == 4:     # "Y" Button
-        print("button 4 down")
+        fancy.debug("button 4 down")
     elif event.button == 5:  
-        print("button 5 down")
+        fancy.debug("button 5 down")
     elif event.button == 6:     # Left Bumper
         inReverse = 1               # Set boolean to true
         rgb.setBlue(255)            # Activate Reverse Indicator
@@ -263,11 +396,11 @@ def buttonPressEvent(event):
         fancy.Print("Rover is Now Front Facing")
         # print("button 7 down")
     elif event.button == 8:     # Left joystick button
-        print("button 8 down")
+        fancy.debug("button 8 down")
     elif event.button == 9:     # Right joystick button
-        print("button 9 down")
+        fancy.debug("button 9 down")
     elif event.button == 10:    # XBOX button
-        print("button 10 down")
+        fancy.debug("button 10 down")
    
 
 def duoControlsFront(event):
@@ -440,6 +573,7 @@ def setDuty(motorCode, dutyCycle):
         new = tempNew                               # Set output to tempNew
 
     motorPins[motorCode-1].setDutyCycle(new)
+    telemetry.record(telemetry.DUTY, motorPins[motorCode-1].pin_num, dutyCycle, new)
 
 
 
@@ -454,10 +588,19 @@ def cleanUP():
     # Outputs : none
     # Globals : uno     -   Calls the arduino communication variable
 
+    if skippedAxes:                     # Report what coalescing saved
+        fancy.info("%d stale joystick events were skipped", skippedAxes)
+    if loop and loop.totalTicks:        # Report how the control loop kept up
+        fancy.info("%s, %d of %d passes overran in total", loop.summary(), loop.totalOverruns, loop.totalTicks)
+    if inputLatency:                    # Report how fast idle mode reacted
+        fancy.info("%d idle wake-ups, motors updated %.2f/%.2f ms mean/max after the input",
+                   len(inputLatency), sum(inputLatency) / len(inputLatency) * 1000, max(inputLatency) * 1000)
     GPIO.cleanup()                      # Disable gpio pins
     # arduino.exit()                      # Disconnect Arduino
     fancy.Print("Program Terminated")   # Inform of termination
-    fancy.close()                       # Delete fancy text file
+    telemetry.close()                   # Flush the telemetry ring buffer
+    inputLog.close()                    # Finish any controller recording
+    fancy.close()                       # Save the fancy log segment
 
 
 def handleInterrupt(signum, frame):
@@ -482,24 +625,69 @@ def handleInterrupt(signum, frame):
 atexit.register(cleanUP)                            # Tells the cleanup function to run at close
 signal.signal(signal.SIGINT, handleInterrupt)       # Define the keyboardInterupt Response
 fancy.start()                                       # Enable output tracking
+try:
+    fancy.setLevel(os.environ.get('ROVER_LOG_LEVEL', 'INFO'))   # DEBUG shows every button press
+except KeyError:                                    # Mistyped, keep driving at the default level
+    fancy.warning("WARNING : Unknown ROVER_LOG_LEVEL %s, using INFO", os.environ['ROVER_LOG_LEVEL'])
+startup.report(fancy.info)                          # How long each step of startup took
+if not startupReady:
+    fancy.warning("WARNING : Starting before everything was ready")
+telemetry.start()                                   # Enable event recording
+if os.environ.get('ROVER_RECORD'):                  # Record the controller, e.g. ROVER_RECORD=logs/drive.rec
+    inputLog.start(os.environ['ROVER_RECORD'])
 print("\n")                                         # Break line
 fancy.Print("Welcome to the RIT SPEX Rover")        # Welcome Message
 
 
 motorPins = initGPIO()                  # Activate GPIO Pins
+startup.mark("GPIO initialised", fancy.info)
+
+
+if os.environ.get('ROVER_REPLAY'):      # Drive from a recording instead of the controller
+    replayPath = os.environ['ROVER_REPLAY']
+    controller = inputLog.ReplayController()    # Stands in for a joystick so axis events are acted on
+    inReverse = 0                           # Start in the same modes getController sets
+    aPresses = []
+    slowMode = 0
+    rgb.setColor("green")
+    fancy.Print("Replaying " + os.path.basename(replayPath))
+    replayStart = time.perf_counter()
+    try:                                    # ROVER_REPLAY_SPEED=0 replays as fast as possible
+        inputLog.replay(replayPath, lambda events: receiveXboxSignals(controller, events, False),
+                        float(os.environ.get('ROVER_REPLAY_SPEED', '1')))
+    finally:                                # Also when a recorded "X" press ends the program
+        replayTime = time.perf_counter() - replayStart
+        fancy.info("Replayed %d events in %.3f s, %.1f us per event", inputLog.replayed, replayTime,
+                   replayTime / max(inputLog.replayed, 1) * 1e6)
+    exit(0)
 
 
 controller = getController()            # Connect to X-Box Controller
+startup.mark("controller connected", fancy.info)
 fancy.Print("Main Code has Begun")
 
 
 ### Main Loop ###
+loop = RateScheduler(controlRate, report=fancy.info)   # Timing is logged every 10 s
+lastInput = time.monotonic()            # Time the controller last sent anything
 while True:
-    receiveXboxSignals(controller)          # xBox Based Controls
-    if pygame.joystick.get_count() == 0:    # Detect disconnection
-        for i in range(6):                      # For each motor
-            setDuty(i+1, 30)                        # Disable motor
-        controller = getController()            # Attempt reconnection (DOES NOT WORK)
+    waiting = []                            # Event that ended an idle wait
+    if idleAfter and time.monotonic() - lastInput > idleAfter:     # Nothing is happening
+        event = pygame.event.wait(idleTimeout)  # Sleep in SDL until an event or the timeout, no CPU used
+        wokeAt = drainedAt = time.monotonic()
+        if event.type != pygame.NOEVENT:
+            waiting.append(event)
+        loop.restart()                          # The wait was not an overrun
+    if receiveXboxSignals(controller, waiting):    # xBox Based Controls
+        lastInput = time.monotonic()
+    if waiting:                             # First pass after an idle wait
+        arrived = getattr(waiting[0], 'time', None)     # Kernel timestamp of the input, evdev only
+        if arrived:                                     # Wall clock, like the kernel's
+            inputLatency.append(time.time() - arrived)
+        else:                                           # pygame events carry no time, count from the wake-up
+            inputLatency.append(lastInput - wokeAt)
+        fancy.debug("Woke from idle, motors updated %.2f ms after the input", inputLatency[-1] * 1000)
+    loop.wait()                             # Sleep until the next pass
 
 
 fancy.Print("The Program Has Completed")
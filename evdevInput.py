@@ -0,0 +1,376 @@
+# Description - Reads gamepads straight from /dev/input/event* as a light replacement for pygame
+# Notes - Provides the few pygame calls controlCode.py uses (init, event.get/wait/set_blocked/set_allowed,
+#         joystick.init/get_count/Joystick) so it can be imported in place of pygame with ROVER_INPUT=evdev.
+#         Axis and button numbers follow SDL's rules (supported codes in order, hats skipped) so they match
+#         what pygame reports, and axes are scaled to [-1, 1] from the kernel's range for each axis.
+#         readEvents decodes a recorded input_event byte stream, e.g. "cat /dev/input/event0 > pad.bin".
+
+# Funtion List
+# InputEvent - One event with the same attributes as a pygame event
+# Gamepad - One open /dev/input/event* device (or recorded byte file) translated to InputEvents
+# Joystick - pygame.joystick.Joystick look-alike for a found gamepad
+# init - Finds the gamepads that are plugged in
+# scan - Opens gamepads that appeared since the last scan
+# get - Returns every waiting event, like pygame.event.get
+# wait - Sleeps until an event arrives, like pygame.event.wait
+# setBlocked - pygame.event.set_blocked
+# setAllowed - pygame.event.set_allowed
+# getCount - Number of gamepads, like pygame.joystick.get_count
+# readEvents - Decodes a recorded input_event byte file
+
+# %% Start Imports ###
+import os                   # Device files
+import glob                 # Lists /dev/input/event*
+import time                 # Rescans and timeouts
+import errno                # Unplugged devices
+import fcntl                # Axis ranges from the kernel
+import select               # Sleeps until a device has data
+import struct               # input_event records
+import collections          # Events waiting to be returned
+import types                # pygame style event and joystick namespaces
+### End imports ###
+
+NOEVENT = 0                 # Same numbers as pygame so events and recordings are interchangeable
+QUIT = 256
+JOYAXISMOTION = 1536
+JOYHATMOTION = 1538
+JOYBUTTONDOWN = 1539
+JOYBUTTONUP = 1540
+JOYDEVICEADDED = 1541
+JOYDEVICEREMOVED = 1542
+
+EV_SYN = 0                  # Kernel event types and codes (linux/input-event-codes.h)
+EV_KEY = 1
+EV_ABS = 3
+SYN_REPORT = 0
+SYN_DROPPED = 3
+ABS_HAT0X = 0x10            # Hats are reported separately and are not axes
+ABS_HAT3Y = 0x17
+BTN_MISC = 0x100
+BTN_JOYSTICK = 0x120
+BTN_GAMEPAD = 0x130         # BTN_SOUTH, the "A" button
+KEY_MAX = 0x2ff
+
+defaultAxes = {0: 0, 1: 1, 2: 2, 5: 3, 9: 4, 10: 5}     # ABS_X, ABS_Y, ABS_Z, ABS_RZ, ABS_GAS, ABS_BRAKE when sysfs is not there
+defaultRange = (-32768, 32767)                          # Axis range when the kernel can not be asked
+eventFormat = 'llHHi'       # struct input_event: seconds, microseconds, type, code, value
+scanInterval = 0.5          # Seconds between looks for newly plugged in gamepads
+
+gamepads = []               # Open gamepads, the list index is the pygame device index
+pending = collections.deque()   # Events read but not yet returned
+blocked = set()             # Event types that are dropped
+onlyAllowed = None          # Event types that are kept once set_blocked(None) was called, None before that
+nextInstance = 0            # Instance id for the next gamepad
+lastScan = 0                # Time of the last scan
+
+#%%####### Start Custom Functions ##########
+
+
+class InputEvent:
+    """
+    One input event, with the attributes pygame gives the same event type
+    (axis and value, button, device_index or instance_id) plus the kernel timestamp.
+    """
+    def __init__(self, type, **attributes):
+        self.type = type
+        self.__dict__.update(attributes)
+
+    def __repr__(self):
+        return "InputEvent(" + ", ".join(key + "=" + repr(value) for key, value in self.__dict__.items()) + ")"
+
+
+class Gamepad:
+    """
+    One gamepad device, or a recorded input_event file, translated into InputEvents.
+    Example : pad = Gamepad("/dev/input/event0"); events = pad.read()
+    """
+    def __init__(self, path, instanceId=0, layout=eventFormat):
+        self.path = path
+        self.instanceId = instanceId
+        self.record = struct.Struct(layout)             # A file recorded on another pi may need another layout
+        self.fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+        self.partial = b''                              # Bytes of an unfinished record
+        self.dropping = False                           # The kernel lost events, skip to the next report
+        sysfs = "/sys/class/input/" + os.path.basename(path) + "/device/"
+        self.name = readText(sysfs + "name") or os.path.basename(path)
+        absCodes = readBits(sysfs + "capabilities/abs")
+        keyCodes = readBits(sysfs + "capabilities/key")
+        if absCodes:                                    # Number axes the way SDL does
+            axes = [code for code in sorted(absCodes) if not ABS_HAT0X <= code <= ABS_HAT3Y]
+            self.axes = {code: index for index, code in enumerate(axes)}
+        else:
+            self.axes = dict(defaultAxes)
+        if keyCodes:                                    # SDL numbers joystick buttons first, then misc buttons
+            keys = sorted(code for code in keyCodes if BTN_JOYSTICK <= code <= KEY_MAX)
+            keys += sorted(code for code in keyCodes if BTN_MISC <= code < BTN_JOYSTICK)
+            self.buttons = {code: index for index, code in enumerate(keys)}
+        else:
+            self.buttons = None                             # code - BTN_GAMEPAD
+        self.ranges = {code: absRange(self.fd, code) or defaultRange for code in self.axes}
+
+    def fileno(self):
+        return self.fd
+
+    def read(self):
+        # Reads everything the device has waiting without blocking
+        # Inputs  : none
+        # Outputs : events - InputEvents, a JOYDEVICEREMOVED if the device was unplugged
+        data = b''
+        try:
+            while True:
+                chunk = os.read(self.fd, self.record.size * 64)
+                if not chunk:                               # End of a recorded file
+                    break
+                data += chunk
+        except BlockingIOError:                         # Nothing more waiting
+            pass
+        except OSError as error:
+            if error.errno != errno.ENODEV:
+                raise
+            events = self.translate(data)
+            events.append(InputEvent(JOYDEVICEREMOVED, instance_id=self.instanceId, time=time.time()))
+            return events
+        return self.translate(data)
+
+    def translate(self, data):
+        # Turns input_event records into InputEvents, keeping any unfinished record for next time
+        # Inputs  : data - bytes read from the device
+        # Outputs : events - InputEvents
+        data = self.partial + data
+        end = len(data) - len(data) % self.record.size
+        self.partial = data[end:]
+        events = []
+        for seconds, micros, kind, code, value in self.record.iter_unpack(data[:end]):
+            if kind == EV_SYN:
+                if code == SYN_DROPPED:                     # Kernel buffer overflowed, positions are stale
+                    self.dropping = True
+                elif code == SYN_REPORT and self.dropping:  # Start again from the real positions
+                    self.dropping = False
+                    events += self.currentAxes(seconds + micros / 1e6)
+            elif self.dropping:
+                continue
+            elif kind == EV_ABS and code in self.axes:
+                events.append(InputEvent(JOYAXISMOTION, instance_id=self.instanceId, axis=self.axes[code],
+                                         value=self.scale(code, value), time=seconds + micros / 1e6))
+            elif kind == EV_KEY and value != 2:             # 2 is key repeat
+                button = self.buttons.get(code) if self.buttons else code - BTN_GAMEPAD
+                if button is not None and button >= 0:
+                    events.append(InputEvent(JOYBUTTONDOWN if value else JOYBUTTONUP, instance_id=self.instanceId,
+                                             button=button, time=seconds + micros / 1e6))
+        return events
+
+    def scale(self, code, value):
+        # Scales a raw axis value to [-1, 1]
+        low, high = self.ranges[code]
+        if high <= low:
+            return 0.0
+        return max(-1.0, min(1.0, (value - low) * 2.0 / (high - low) - 1.0))
+
+    def currentAxes(self, stamp):
+        # Axis events for where every axis is now, after the kernel dropped events
+        events = []
+        for code, axis in self.axes.items():
+            info = absInfo(self.fd, code)
+            if info:
+                events.append(InputEvent(JOYAXISMOTION, instance_id=self.instanceId, axis=axis,
+                                         value=self.scale(code, info[0]), time=stamp))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Joystick:
+    """
+    pygame.joystick.Joystick look-alike for the gamepad at a device index.
+    """
+    def __init__(self, index):
+        self.pad = gamepads[index]
+
+    def init(self):
+        pass                                # Gamepads are opened when they are found
+
+    def get_name(self):
+        return self.pad.name
+
+    def get_instance_id(self):
+        return self.pad.instanceId
+
+    def get_numaxes(self):
+        return len(self.pad.axes)
+
+    def get_numbuttons(self):
+        return len(self.pad.buttons) if self.pad.buttons else 0
+
+
+def readText(path):
+    # Reads a one line sysfs file, None if it is not there
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def readBits(path):
+    # Reads a sysfs capability bitmap ("1b 0 0 0", most significant word first) into a set of codes
+    text = readText(path)
+    if not text:
+        return set()
+    wordBits = struct.calcsize('l') * 8         # The kernel prints C longs
+    codes = set()
+    for word, hexText in enumerate(reversed(text.split())):
+        bits = int(hexText, 16)
+        codes.update(word * wordBits + bit for bit in range(wordBits) if bits >> bit & 1)
+    return codes
+
+
+def absInfo(fd, code):
+    # Asks the kernel for an axis's (value, minimum, maximum) with EVIOCGABS, None for a plain file
+    request = (2 << 30) | (24 << 16) | (ord('E') << 8) | (0x40 + code)      # _IOR('E', 0x40 + code, struct input_absinfo)
+    try:
+        return struct.unpack('6i', fcntl.ioctl(fd, request, bytes(24)))[:3]
+    except OSError:
+        return None
+
+
+def absRange(fd, code):
+    # Axis (minimum, maximum) from the kernel, None for a plain file
+    info = absInfo(fd, code)
+    return info[1:] if info else None
+
+
+def init():
+    # Finds the gamepads that are plugged in, each is announced with a JOYDEVICEADDED event like pygame does
+    # Inputs  : none
+    # Outputs : none
+    scan()
+
+
+def scan():
+    # Opens every gamepad that is not open yet
+    # Inputs  : none
+    # Outputs : none
+    # Globals : gamepads, nextInstance, lastScan - Open gamepads
+
+    global nextInstance, lastScan
+
+    lastScan = time.monotonic()
+    known = {pad.path for pad in gamepads}
+    paths = sorted(glob.glob('/dev/input/event*'), key=lambda path: int(path[len('/dev/input/event'):] or 0))
+    for path in paths:
+        if path in known:
+            continue
+        keys = readBits("/sys/class/input/" + os.path.basename(path) + "/device/capabilities/key")
+        if BTN_GAMEPAD not in keys and BTN_JOYSTICK not in keys:   # Keyboard, mouse, power button...
+            continue
+        try:
+            pad = Gamepad(path, nextInstance)
+        except OSError:                                 # No permission (add the user to "input") or just unplugged
+            continue
+        nextInstance += 1
+        gamepads.append(pad)
+        queueEvents([InputEvent(JOYDEVICEADDED, device_index=len(gamepads) - 1)])
+
+
+def queueEvents(events):
+    # Keeps the events that are not blocked
+    for event in events:
+        if event.type in onlyAllowed if onlyAllowed is not None else event.type not in blocked:
+            pending.append(event)
+
+
+def poll():
+    # Reads every gamepad, dropping unplugged ones, and looks for new gamepads now and then
+    for pad in list(gamepads):
+        events = pad.read()
+        if events and events[-1].type == JOYDEVICEREMOVED:     # Unplugged
+            gamepads.remove(pad)
+            pad.close()
+        queueEvents(events)
+    if time.monotonic() - lastScan >= scanInterval:
+        scan()
+
+
+def get():
+    # Returns every waiting event, like pygame.event.get
+    # Inputs  : none
+    # Outputs : events - list of InputEvents
+    poll()
+    events = list(pending)
+    pending.clear()
+    return events
+
+
+def wait(timeout=0):
+    # Sleeps until an event arrives, like pygame.event.wait
+    # Inputs  : timeout - longest wait in milliseconds, 0 waits forever
+    # Outputs : event - the first event, NOEVENT if the time ran out
+    end = time.monotonic() + timeout / 1000 if timeout else None
+    while True:
+        poll()
+        if pending:
+            return pending.popleft()
+        sleep = scanInterval if end is None else min(scanInterval, end - time.monotonic())
+        if sleep <= 0:
+            return InputEvent(NOEVENT)
+        select.select(gamepads, [], [], sleep)      # Woken by the first byte from any gamepad
+
+
+def setBlocked(eventTypes):
+    # pygame.event.set_blocked, None blocks everything
+    # Inputs  : eventTypes - event type or list of types
+    # Globals : blocked, onlyAllowed - Event types get returns
+    global onlyAllowed
+
+    if eventTypes is None:
+        onlyAllowed = set()
+    elif onlyAllowed is not None:
+        onlyAllowed.difference_update(asList(eventTypes))
+    else:
+        blocked.update(asList(eventTypes))
+
+
+def setAllowed(eventTypes):
+    # pygame.event.set_allowed, None allows everything
+    # Inputs  : eventTypes - event type or list of types
+    # Globals : blocked, onlyAllowed - Event types get returns
+    global onlyAllowed
+
+    if eventTypes is None:
+        onlyAllowed = None
+        blocked.clear()
+    elif onlyAllowed is not None:
+        onlyAllowed.update(asList(eventTypes))
+    else:
+        blocked.difference_update(asList(eventTypes))
+
+
+def asList(eventTypes):
+    return eventTypes if isinstance(eventTypes, (list, tuple, set)) else [eventTypes]
+
+
+def getCount():
+    # Number of open gamepads, like pygame.joystick.get_count
+    poll()
+    return len(gamepads)
+
+
+def readEvents(path, layout=eventFormat):
+    # Decodes a recorded input_event byte file, using the default axis numbers and ranges
+    # Inputs  : path   - file of raw input_event records
+    #           layout - struct layout of one record ('llHHi' is the native one, 'qqHHi' a 64-bit pi)
+    # Outputs : events - list of InputEvents
+    # Example : readEvents("pad.bin") after "cat /dev/input/event0 > pad.bin" on the rover
+    pad = Gamepad(path, layout=layout)
+    try:
+        return pad.read()
+    finally:
+        pad.close()
+
+
+event = types.SimpleNamespace(get=get, wait=wait, set_blocked=setBlocked, set_allowed=setAllowed)
+joystick = types.SimpleNamespace(init=init, get_count=getCount, Joystick=Joystick)
+
+
+### End Custom Functions ###
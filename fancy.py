@@ -1,70 +1,357 @@
 import sys
 import math
 import os
+import time
+import glob
+import queue
+import threading
+import subprocess
 
 
-def start():
-    # Function enables tracking of the terminal output
-    # Inputs  : none
-    # Outputs : none
-    # Globals : none
+class Tee:
+    """
+    Tee object that captures output to both stdout and a file.
+    Remembers the last line written so Print never has to re-read the log.
+    File writes are handed to a background thread so callers never wait on the disk.
+    The log is split into segments by size and age, closed segments are gzipped by a
+    separate process and the oldest are deleted once the disk budget is used up.
+    """
+    def __init__(self, filename, stream, queueSize=1000, flushSize=4096, flushInterval=0.5, whenFull="drop",
+                 maxBytes=1024*1024, maxAge=3600, diskBudget=50*1024*1024, blockTimeout=0.5):
+        self.filename = filename
+        self.stream = stream
+        self.maxBytes = maxBytes            # Segment size that triggers a rotation
+        self.maxAge = maxAge                # Segment age in seconds that triggers a rotation
+        self.diskBudget = diskBudget        # Total bytes all closed segments may use
+        self.compressing = []               # gzip processes that have not finished yet
+        if os.path.exists(filename) and os.path.getsize(filename) > 0:     # Left over from a crash
+            self.saveSegment()
+        self.openSegment()
+        self.lastLine = ""                  # Last line written, newline included once finished
+        self.queue = queue.Queue(queueSize) # Writes waiting for the disk
+        self.flushSize = flushSize          # Bytes buffered before a flush is forced
+        self.flushInterval = flushInterval  # Seconds buffered data may wait before a flush
+        self.block = whenFull == "block"    # Wait for room when the queue is full instead of dropping
+        self.blockTimeout = blockTimeout    # Longest wait for room so a hung disk cannot stop the caller, None waits forever
+        self.dropped = 0                    # Writes lost to a full queue
+        self.writer = threading.Thread(target=self.writeLoop, name="fancyWriter", daemon=True)
+        self.writer.start()
 
-    # Note: Code came from ChatGPT
+    def write(self, data):
+        self.stream.write(data)
+        self.trackLine(data)
+        try:
+            self.queue.put(data, self.block, self.blockTimeout)     # Hand the text to the writer thread
+        except queue.Full:                          # Queue is full and dropping is allowed, or the writer is stuck
+            self.dropped += 1
 
+    def flush(self):
+        self.stream.flush()                         # The writer thread flushes the file on its own schedule
 
-    class Tee:
-        """
-        Tee object that captures output to both stdout and a file.
-        """
-        def __init__(self, filename, stream):
-            self.file = open(filename, 'a')
-            self.stream = stream
+    def trackLine(self, data):
+        # Updates lastLine the same way readlines()[-1] would see the file
+        # Inputs  : data - text that was just written
+        # Outputs : none
+        if not data:                                    # Nothing was written
+            return
+        if not self.lastLine.endswith('\n'):            # If the last line is unfinished
+            data = self.lastLine + data                     # Continue it
+        if data.endswith('\n'):                         # If the write finished a line
+            self.lastLine = data[:-1].rpartition('\n')[2] + '\n'
+        else:                                           # If the write left a line open
+            self.lastLine = data.rpartition('\n')[2]
 
-        def __del__(self):
-            self.file.close()
+    def writeLoop(self):
+        # Background thread that batches queued text into the log file
+        # Inputs  : none
+        # Outputs : none
+        pending = []                                    # Text waiting to be written
+        pendingSize = 0                                 # Characters waiting to be written
+        lastFlush = time.monotonic()                    # Time of the last flush
+        running = True
+        while running:
+            if pending:                                 # Wake up in time for the next timed flush
+                timeout = max(0, lastFlush + self.flushInterval - time.monotonic())
+            elif self.compressing:                      # Check on gzip now and then
+                timeout = 0.5
+            else:                                       # Nothing buffered so sleep until text arrives
+                timeout = None
+            try:
+                data = self.queue.get(timeout=timeout)
+                while data is not None:                     # Grab everything else that is waiting
+                    pending.append(data)
+                    pendingSize += len(data)
+                    data = self.queue.get_nowait()
+                running = False                             # A None means close was called
+            except queue.Empty:
+                pass
+            now = time.monotonic()
+            if pending and (not running or pendingSize >= self.flushSize or now - lastFlush >= self.flushInterval):
+                if self.file is None:                       # The last rotation failed, try again
+                    self.rotate()
+                try:
+                    if self.file is None:
+                        raise OSError("no log segment is open")
+                    self.file.write(''.join(pending))
+                    self.file.flush()
+                    self.segmentSize += pendingSize
+                except OSError:                             # Disk full or gone, lose the text not the rover
+                    self.dropped += len(pending)
+                pending = []
+                pendingSize = 0
+                lastFlush = now
+            if self.file and (self.segmentSize >= self.maxBytes or
+                              (self.segmentSize and now - self.segmentStart >= self.maxAge)):
+                self.rotate()                               # Start a fresh segment
+            if self.compressing:
+                try:
+                    self.enforceBudget()                    # Once gzip is done the sizes are final
+                except OSError:                             # A segment went missing, try again later
+                    pass
+        try:
+            if self.file:
+                self.file.close()
+            if self.segmentSize:                        # Keep the final segment
+                self.saveSegment()
+            else:                                       # Nothing worth keeping
+                os.remove(self.filename)
+            for process in self.compressing:            # Let the last segments finish compressing
+                process.wait(1.0)
+            self.enforceBudget()
+        except (OSError, subprocess.TimeoutExpired):    # Disk trouble or a slow gzip, leave whatever is there
+            pass
 
-        def write(self, data):
-            self.file.write(data)
-            self.file.flush()
-            self.stream.write(data)
+    def rotate(self):
+        # Closes the active segment and opens a new one, self.file is None if the disk would not allow it
+        # Inputs  : none
+        # Outputs : none
+        try:
+            if self.file:
+                self.file.close()
+        except OSError:                                 # Could not write the last of it
+            pass
+        self.file = None
+        try:
+            if os.path.exists(self.filename) and os.path.getsize(self.filename) > 0:   # Never reopen over a segment
+                self.saveSegment()
+            self.openSegment()
+        except OSError:                                 # Tried again at the next flush
+            self.file = None
 
-        def flush(self):
-            self.file.flush()
-            self.stream.flush()
+    def openSegment(self):
+        # Opens a new, empty active segment
+        # Inputs  : none
+        # Outputs : none
+        self.file = open(self.filename, 'w')
+        self.segmentSize = 0                            # Characters in the active segment
+        self.segmentStart = time.monotonic()            # Time the active segment was opened
+
+    def saveSegment(self):
+        # Renames the closed active segment and starts compressing it
+        # Inputs  : none
+        # Outputs : none
+        root, ext = os.path.splitext(self.filename)
+        saved = root + time.strftime("-%Y%m%d-%H%M%S") + "-%06d" % (time.time() % 1 * 1e6) + ext
+        os.rename(self.filename, saved)
+        try:
+            self.compressing.append(subprocess.Popen(["gzip", "-f", saved], stdout=subprocess.DEVNULL,
+                                                     stderr=subprocess.DEVNULL,
+                                                     start_new_session=True))   # Own session so Ctrl+C does not stop it
+        except OSError:                                 # No gzip on this machine
+            pass                                            # Keep the segment uncompressed
+        self.enforceBudget()
+
+    def enforceBudget(self):
+        # Deletes the oldest saved segments until they fit the disk budget, the newest is always kept
+        # Waits until no gzip is running, so each segment is counted once and at its compressed size
+        # Inputs  : none
+        # Outputs : none
+        self.compressing = [process for process in self.compressing if process.poll() is None]   # Reaps finished ones
+        if self.compressing:                            # Checked again once they finish
+            return
+        root, ext = os.path.splitext(self.filename)
+        segments = sorted(glob.glob(root + "-*"))       # Oldest first thanks to the timestamp names
+        sizes = [os.path.getsize(segment) for segment in segments]
+        while len(segments) > 1 and sum(sizes) > self.diskBudget:  # Delete the oldest until under budget
+            try:
+                os.remove(segments.pop(0))
+            except OSError:                                 # Already gone
+                pass
+            sizes.pop(0)
+
+    def close(self, timeout=5.0):
+        # Writes out everything still queued and closes the log file
+        # Inputs  : timeout - longest wait in seconds for the writer thread, so exit never hangs
+        # Outputs : none
+        try:
+            self.queue.put(None, timeout=timeout)       # Wait here so the final text is kept
+        except queue.Full:                              # Writer is stuck
+            pass
+        self.writer.join(timeout)
+        if self.writer.is_alive():
+            self.stream.write("fancy: the log writer did not finish, the end of the log may be missing\n")
+        if self.dropped:                                # Let the user know the log has gaps
+            self.stream.write("fancy: %d writes were dropped from the log file\n" % self.dropped)
+
+
+tee = None      # Tee installed by start
+
+DEBUG = 10      # Per-event detail, off while driving
+INFO = 20       # Normal status messages
+WARNING = 30    # Something looks wrong
+ERROR = 40      # Something failed
+levelNames = {"DEBUG": DEBUG, "INFO": INFO, "WARNING": WARNING, "ERROR": ERROR}
+
+level = INFO            # Messages below this level are skipped without being formatted
+repeatWindow = 1.0      # Seconds an identical message is held back before it is printed again
+repeatKey = None        # Level, message and arguments of the last printed message
+repeatCount = 0         # Times that message was logged since it was printed, itself included
+repeatTime = 0          # Time that message was printed
+repeatTimer = None      # Prints the held back count once the window is over
+repeatLock = threading.RLock()  # log may be called from several threads and the timer
 
-    # Define the log file path
-    log_file_path = "outputLogs.txt"
 
-    # Create a file object for the log file
-    log_file = open(log_file_path, 'w')
+def start(logDir="logs", **options):
+    # Function enables tracking of the terminal output
+    # Inputs  : logDir  - Folder that holds the active log and the saved segments
+    #           options - Tee settings (queueSize, flushSize, flushInterval, whenFull="drop"/"block",
+    #                     blockTimeout, maxBytes, maxAge, diskBudget)
+    # Outputs : none
+    # Globals : tee - Tee object that replaced sys.stdout
+
+    # Note: Code came from ChatGPT
+
+    global tee
+
+    # Define the log file path
+    os.makedirs(logDir, exist_ok=True)
+    log_file_path = os.path.join(logDir, "outputLogs.txt")
 
     # Create a Tee object to capture output to both stdout and the log file
-    tee = sys.stdout = Tee(log_file_path, sys.stdout)
+    tee = sys.stdout = Tee(log_file_path, sys.stdout, **options)
 
 
 def Print(inputText):
     # Provides formatted output for important information
     # Inputs  : none
     # Outputs : none
-    # Globals : none
+    # Globals : tee - Tracks the last line of the log file
+
 
-    
     dashLen = 50                                                    # Number of dashes
     breakLine = "-" * dashLen                                       # Create the breakline
     inputText = str(inputText)
-    with open("outputLogs.txt", 'r') as f:       # Open the log file
-        lines = f.readlines()                                           # Read the last line
-        if "-------" not in lines[-1].strip():                          # If there was no breakline above
-            print(breakLine)                                                # Add a breakline
-        textLength = len(inputText)                                     # Length of input
-        sides = math.floor((dashLen - textLength - 2) / 2)              # Finds amount of side dashes
-        sides = '-' * sides                                             # Generates side walls
-        if textLength % 2 == 0:                                         # If text length is even
-            print(sides + " " + inputText + " " + sides)                    # Normal formatted print
-        else:                                                           # If text length is odd
-            print(sides + " " + inputText + " -" + sides)                   # Formatted print with an extra dash
-        print(breakLine)                                                # Print ending breakline
+    flushRepeats()                                                  # Keep held back messages above the banner
+    lastLine = tee.lastLine if tee else ""                          # Last line of the log file
+    if "-------" not in lastLine.strip():                           # If there was no breakline above
+        print(breakLine)                                                # Add a breakline
+    textLength = len(inputText)                                     # Length of input
+    sides = math.floor((dashLen - textLength - 2) / 2)              # Finds amount of side dashes
+    sides = '-' * sides                                             # Generates side walls
+    if textLength % 2 == 0:                                         # If text length is even
+        print(sides + " " + inputText + " " + sides)                    # Normal formatted print
+    else:                                                           # If text length is odd
+        print(sides + " " + inputText + " -" + sides)                   # Formatted print with an extra dash
+    print(breakLine)                                                # Print ending breakline
+
+
+def setLevel(newLevel):
+    # Changes which messages log prints
+    # Inputs  : newLevel - level number or name ("DEBUG", "INFO", "WARNING", "ERROR")
+    # Outputs : none
+    # Globals : level - Lowest level that is printed
+
+    global level
+
+    if isinstance(newLevel, str):                   # Convert names to numbers
+        newLevel = levelNames[newLevel.upper()]
+    level = newLevel
+
+
+def log(msgLevel, message, *args):
+    # Prints a message if its level is enabled, identical repeats are held back and counted
+    # Inputs  : msgLevel - level of the message
+    #           message  - text, formatted with % args only when it is printed
+    #           args     - values for the message, kept to spot repeats so pass copies of lists that change later
+    # Outputs : none
+    # Globals : repeatKey, repeatCount, repeatTime - Tracks the last printed message
+
+    global repeatKey, repeatCount, repeatTime, repeatTimer
+
+    if msgLevel < level:                            # Disabled, so do no work at all
+        return
+    key = (msgLevel, message, args)
+    with repeatLock:
+        now = time.monotonic()
+        if key == repeatKey and now - repeatTime < repeatWindow:    # Same message too soon
+            repeatCount += 1                                            # Count it instead of printing
+            if repeatTimer is None:                                     # First one held back, report at the window's end
+                repeatTimer = threading.Timer(repeatTime + repeatWindow - now, flushRepeats, [key])
+                repeatTimer.daemon = True
+                repeatTimer.start()
+            return
+        flushRepeats()                              # Report what was held back of the last message
+        print(message % args if args else message)
+        repeatKey = key
+        repeatCount = 1
+        repeatTime = now
+
+
+def flushRepeats(key=None):
+    # Prints the total count of the last message if copies were held back, e.g. "button 0 down x14"
+    # Inputs  : key - only flush if this is still the last message, for the window timer
+    # Outputs : none
+    # Globals : repeatKey, repeatCount, repeatTimer - Tracks the last printed message
+
+    global repeatKey, repeatCount, repeatTimer
+
+    with repeatLock:
+        if key is not None and key != repeatKey:    # Already flushed by a newer message
+            return
+        if repeatTimer is not None:
+            repeatTimer.cancel()
+            repeatTimer = None
+        if repeatCount > 1:                         # Only when something was held back
+            msgLevel, message, args = repeatKey
+            print((message % args if args else message) + " \u00d7" + str(repeatCount))
+        repeatKey = None
+        repeatCount = 0
+
+
+def debug(message, *args):
+    # log at DEBUG level, checked here first so disabled calls cost one comparison
+    if level <= DEBUG:
+        log(DEBUG, message, *args)
+
+
+def info(message, *args):
+    # log at INFO level
+    if level <= INFO:
+        log(INFO, message, *args)
+
+
+def warning(message, *args):
+    # log at WARNING level
+    if level <= WARNING:
+        log(WARNING, message, *args)
+
+
+def error(message, *args):
+    # log at ERROR level
+    if level <= ERROR:
+        log(ERROR, message, *args)
 
 
 def close():
-    os.remove("outputLogs.txt")
+    # Flushes the log file, restores the terminal and saves the final log segment
+    # Inputs  : none
+    # Outputs : none
+    # Globals : tee - Tee object that replaced sys.stdout
+
+    global tee
+
+    flushRepeats()                          # Report any held back messages
+    if tee:                                 # If output tracking was started
+        sys.stdout = tee.stream                 # Give the terminal back
+        tee.close()                             # Final flush of the log file
+        tee = None
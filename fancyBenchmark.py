@@ -0,0 +1,34 @@
+# Author - Ethan Leone
+# Description - Times fancy.Print banners as outputLogs.txt grows to show the cost stays flat
+# Notes - Run from a scratch directory, the log segments are saved to logs/ in the working directory
+
+import os
+import sys
+import time
+import fancy
+
+terminal = sys.stdout                       # Keep the real terminal for results
+sys.stdout = open(os.devnull, 'w')          # Silence the Tee's terminal side
+fancy.start(whenFull="block", maxBytes=2**40, diskBudget=2**40)   # Keep every write in one growing segment
+
+filler = "Python: Set the duty percentage to 29.\n" * 1000     # About 40 kB per chunk
+repeats = 200                                                   # Banners timed per log size
+
+written = 0                                                     # Characters sent to the log so far
+
+terminal.write("log size (MB) | banner (us)\n")
+for targetMB in [0, 1, 4, 16, 64]:
+    while written < targetMB * 1024 * 1024:                     # Grow the log
+        sys.stdout.write(filler)
+        written += len(filler)
+    while os.path.getsize(fancy.tee.filename) < written:        # Let the writer thread catch up
+        time.sleep(0.01)
+    startTime = time.perf_counter()
+    for i in range(repeats):
+        fancy.Print("Rover is Now in Reverse")
+        print("button 6 down")                                  # Force a breakline on the next banner
+    banner = (time.perf_counter() - startTime) / repeats * 1e6
+    terminal.write("%13.1f | %11.1f\n" % (os.path.getsize(fancy.tee.filename) / 1024 / 1024, banner))
+
+fancy.close()
+sys.stdout = terminal
@@ -0,0 +1,140 @@
+# Description - Records the controller events the rover handles and replays them through the same handlers
+# Notes - Each event is a 16 byte record (time since the recording started, pygame event type, axis/button, value)
+#         so a recording gives a repeatable workload for timing calcDutyCycle/setDuty without anyone on the sticks.
+#         Event types are pygame's numbers, which evdevInput uses too, so either backend can record or replay.
+
+# Funtion List
+# start - Opens a recording file
+# record - Adds the events receiveXboxSignals is about to handle to the recording
+# close - Finishes the recording
+# load - Reads a recording back as (seconds, event) pairs
+# replay - Feeds a recording through an event handler in real time, faster, or as fast as possible
+# ReplayController - Stands in for the joystick while a recording is replayed
+
+# %% Start Imports ###
+import os                   # Folders
+import time                 # Timestamps and pacing
+import struct               # Fixed-width records
+from evdevInput import InputEvent, JOYAXISMOTION, JOYBUTTONDOWN, JOYBUTTONUP, JOYDEVICEADDED, JOYDEVICEREMOVED
+### End imports ###
+
+magic = b"RVIN"                                 # Marks a recording
+version = 1                                     # Record layout version
+header = struct.Struct("<4sHHd")                # magic, version, record size, wall clock start time
+entry = struct.Struct("<dHhf")                  # seconds since start, event type, code, value
+
+codeNames = {JOYAXISMOTION: "axis", JOYBUTTONDOWN: "button", JOYBUTTONUP: "button",
+             JOYDEVICEADDED: "device_index", JOYDEVICEREMOVED: "instance_id"}      # Attribute stored as the code
+
+recordFile = None   # Open recording
+recordStart = 0     # Monotonic time the recording started
+replayed = 0        # Events handed to the handler by the current or last replay
+
+#%%####### Start Custom Functions ##########
+
+
+def start(path="logs/controller.rec"):
+    # Starts recording to a new file
+    # Inputs  : path - recording file, replaced if it exists
+    # Outputs : none
+    # Globals : recordFile, recordStart - Recording state
+
+    global recordFile, recordStart
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    recordFile = open(path, 'wb')
+    recordFile.write(header.pack(magic, version, entry.size, time.time()))
+    recordStart = time.monotonic()
+
+
+def record(events):
+    # Adds events to the recording, does nothing until start is called
+    # Inputs  : events - pygame (or evdevInput) events, other event types are skipped
+    # Outputs : none
+    # Globals : recordFile - Open recording
+
+    if recordFile is None:
+        return
+    now = time.monotonic() - recordStart
+    for event in events:
+        name = codeNames.get(event.type)
+        if name:
+            recordFile.write(entry.pack(now, event.type, getattr(event, name), getattr(event, 'value', 0.0)))
+
+
+def close():
+    # Finishes the recording
+    # Inputs  : none
+    # Outputs : none
+    # Globals : recordFile - Open recording
+
+    global recordFile
+
+    if recordFile is not None:
+        recordFile.close()
+        recordFile = None
+
+
+def load(path):
+    # Reads a recording
+    # Inputs  : path - recording file
+    # Outputs : events - list of (seconds since the recording started, InputEvent)
+    with open(path, 'rb') as f:
+        data = f.read()
+    fileMagic, fileVersion, recordSize, started = header.unpack_from(data)
+    if fileMagic != magic or fileVersion != version or recordSize != entry.size:
+        raise ValueError(path + " is not a version " + str(version) + " controller recording")
+    end = len(data) - (len(data) - header.size) % entry.size      # Ignore a record cut short by a crash
+    events = []
+    for seconds, kind, code, value in entry.iter_unpack(data[header.size:end]):
+        attributes = {codeNames[kind]: code}
+        if kind == JOYAXISMOTION:
+            attributes['value'] = value
+        events.append((seconds, InputEvent(kind, **attributes)))
+    return events
+
+
+def replay(path, handle, speed=1.0, eventTypes=(JOYAXISMOTION, JOYBUTTONDOWN)):
+    # Feeds a recording through an event handler, one call per recorded pass so coalescing sees the same batches
+    # Inputs  : path       - recording file
+    #           handle     - function called with the list of events one pass took off the queue
+    #           speed      - 1 for real time, 10 for ten times faster, 0 for as fast as possible
+    #           eventTypes - event types to replay, hot-plug events are skipped as there is no controller to bind
+    # Outputs : seconds - time the replay took
+    # Globals : replayed - Events handled so far
+    # Example : replay("logs/controller.rec", lambda events: receiveXboxSignals(None, events, False), 0)
+
+    global replayed
+
+    passes = []                                         # [seconds, events] per recorded pass
+    for seconds, event in load(path):
+        if event.type not in eventTypes:
+            continue
+        if passes and passes[-1][0] == seconds:             # Recorded in the same pass
+            passes[-1][1].append(event)
+        else:
+            passes.append([seconds, [event]])
+    replayed = 0
+    startTime = time.monotonic()
+    for seconds, events in passes:
+        if speed:                                           # Keep the recorded spacing
+            delay = startTime + seconds / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        handle(events)
+        replayed += len(events)
+    return time.monotonic() - startTime
+
+
+class ReplayController:
+    """
+    Stands in for the joystick while a recording is replayed. No hot-plug event ever matches its instance id.
+    """
+    def get_name(self):
+        return "recording"
+
+    def get_instance_id(self):
+        return -1
+
+
+### End Custom Functions ###
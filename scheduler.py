@@ -0,0 +1,85 @@
+# Description - Fixed-rate loop timing for the rover control loop
+# Notes - Ticks are scheduled from the first tick on the monotonic clock, not from the end of the last pass,
+#         so sleep errors never add up into drift. A pass that runs past the next tick is an overrun and the
+#         ticks it covered are skipped rather than run back to back.
+
+# Funtion List
+# RateScheduler - Sleeps to the next tick and counts overruns and jitter
+
+# %% Start Imports ###
+import time                 # Monotonic clock and sleeps
+### End imports ###
+
+#%%####### Start Custom Functions ##########
+
+
+class RateScheduler:
+    """
+    Paces a loop to a fixed rate and measures how well it keeps up.
+    Example : loop = RateScheduler(50, report=print)
+              while True: doWork(); loop.wait()
+    """
+    def __init__(self, rate=50.0, report=None, reportInterval=10.0):
+        self.period = 1.0 / rate            # Seconds between ticks
+        self.report = report                # Called with a summary line every reportInterval, None for never
+        self.reportInterval = reportInterval
+        self.totalTicks = 0                 # Ticks since the start
+        self.totalOverruns = 0              # Overruns since the start
+        self.resetStats()
+        self.restart()
+
+    def restart(self):
+        # Starts the schedule again from now, so a pause (idle wait, reconnection) is not counted as an overrun
+        # Inputs  : none
+        # Outputs : none
+        self.nextTick = time.monotonic()    # Time the current pass was due
+        self.tickStart = self.nextTick      # Time the current pass started
+
+    def resetStats(self):
+        # Clears the numbers for the current report
+        # Inputs  : none
+        # Outputs : none
+        self.ticks = 0                      # Passes finished
+        self.overruns = 0                   # Passes that ran past the next tick
+        self.missed = 0                     # Ticks skipped by overruns
+        self.jitterSum = 0.0                # Total lateness of wake-ups
+        self.jitterMax = 0.0                # Latest wake-up
+        self.busySum = 0.0                  # Time spent working rather than sleeping
+        self.reportStart = time.monotonic()
+
+    def wait(self):
+        # Ends a pass, sleeping until the next tick unless the pass overran
+        # Inputs  : none
+        # Outputs : none
+        now = time.monotonic()
+        self.busySum += now - self.tickStart
+        self.ticks += 1
+        self.totalTicks += 1
+        self.nextTick += self.period
+        if now >= self.nextTick:                        # Behind schedule, start the next pass at once
+            self.overruns += 1
+            self.totalOverruns += 1
+            self.missed += int((now - self.nextTick) / self.period)
+            self.nextTick = now                             # Keep the rate from here, do not catch up
+        else:
+            time.sleep(self.nextTick - now)
+        self.tickStart = time.monotonic()
+        jitter = self.tickStart - self.nextTick         # How late the sleep woke up
+        self.jitterSum += jitter
+        self.jitterMax = max(self.jitterMax, jitter)
+        if self.report and self.tickStart - self.reportStart >= self.reportInterval:
+            self.report(self.summary())
+            self.resetStats()
+
+    def summary(self):
+        # Describes the timing since the last report
+        # Inputs  : none
+        # Outputs : text - e.g. "control loop 49.9 Hz (target 50), load 3%, jitter 0.21/1.30 ms mean/max, 0 overruns"
+        elapsed = time.monotonic() - self.reportStart
+        ticks = max(self.ticks, 1)
+        return ("control loop %.1f Hz (target %.0f), load %.0f%%, jitter %.2f/%.2f ms mean/max, %d overruns (%d ticks missed)"
+                % (self.ticks / elapsed if elapsed else 0, 1 / self.period, self.busySum / ticks / self.period * 100,
+                   self.jitterSum / ticks * 1000, self.jitterMax * 1000, self.overruns, self.missed))
+
+
+### End Custom Functions ###
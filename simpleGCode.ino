@@ -1,39 +1,128 @@
 // Code takes a 6 digit input and converts it into gcode
+// A command may be prefixed with "#" and a two hex digit sequence number,
+// the reply is then "#" + sequence number + " " + gcode so the pi can keep several in flight
+// Binary frames (see encodeFrame in arduino.py) start with 0xA5 and carry up to 14 commands:
+//   0xA5, version, seq, payload length, payload (letter code, joint, int16 value per command), crc8
+// Each command is answered like a sequenced one, a bad frame is answered once with "!" + seq + " ERR ..."
+
+const byte FRAME_SYNC = 0xA5;       // First byte of a binary frame
+const byte FRAME_VERSION = 1;       // Frame layout this sketch understands
+const byte FRAME_MAX = 56;          // Largest payload, 14 commands
+const char LETTERS[] = " PSQMRKHE"; // Letter for each command code
 
 void setup() {
 
   // Set up serial communication at 115200 baud rate
   Serial.begin(115200);
+  Serial.setTimeout(50);      // Longest wait for the rest of a command
+  Serial.print("READY simpleGCode ");   // Tell the pi setup is done and which frame version to use
+  Serial.println(FRAME_VERSION);
 }
 
 void loop() {
   // Read the GCODE from the Raspberry Pi over serial communtication 
   // and set the corresponding information
-  if (Serial.available() > 0 ) {                              // Only run if there is something in the serial buffer 
-    String GCODE = readFromSerial();                    // Custom function to convert the input into an "int"    
-    Serial.println(GCODE);
+  while (Serial.available() > 0 ) {                           // Run every command waiting in the serial buffer
+    if (Serial.peek() == FRAME_SYNC) {                          // Binary frame
+      readFrame();
+    }
+    else if (Serial.peek() == '#') {                            // Sequenced command
+      Serial.read();                                              // Drop the '#'
+      char seq[3] = {0, 0, 0};                                    // Two hex digits and an ending character
+      Serial.readBytes(seq, 2);                                   // Sequence number to echo back
+      String GCODE = readFromSerial();
+      Serial.print('#');
+      Serial.print(seq);
+      Serial.print(' ');
+      Serial.println(GCODE);
+    }
+    else if (Serial.peek() >= '0' && Serial.peek() <= '9') {    // Plain six digit command
+      String GCODE = readFromSerial();                    // Custom function to convert the input into an "int"    
+      Serial.println(GCODE);
+    }
+    else {                                                      // Not the start of any command
+      Serial.read();                                              // Drop the stray byte to resync
+    }
   }
   delay(10);        // Wait for a short period to allow motor to respond
 }
 
 
 
+void readFrame() {
+  // Function reads one binary frame and answers every command in it
+  // Inputs  - none
+  // Outputs - none
+
+  byte frame[5 + FRAME_MAX];                              // Largest possible frame
+  if (Serial.readBytes(frame, 4) < 4) {                     // sync, version, seq, length
+    return;
+  }
+  byte seq = frame[2];
+  byte length = frame[3];
+  if (frame[1] != FRAME_VERSION) {
+    printSeq('!', seq);
+    Serial.println("ERR version");
+    return;
+  }
+  if (length > FRAME_MAX || length % 4 != 0) {
+    printSeq('!', seq);
+    Serial.println("ERR length");
+    return;
+  }
+  if (Serial.readBytes(frame + 4, length + 1) < length + 1) {   // payload and crc
+    printSeq('!', seq);
+    Serial.println("ERR timeout");
+    return;
+  }
+  if (crc8(frame + 1, length + 3) != frame[4 + length]) {
+    printSeq('!', seq);
+    Serial.println("ERR crc");
+    return;
+  }
+  for (int i = 0; i < length; i += 4) {                     // Answer each command
+    byte code = frame[4 + i];
+    int value = (int16_t)(frame[6 + i] | (frame[7 + i] << 8));    // Sign comes from bit 15 even where int is 32 bits
+    printSeq('#', seq + i / 4);
+    if (code >= 1 && code <= 8) {
+      Serial.print(LETTERS[code]);
+    }
+    Serial.print(frame[5 + i]);
+    Serial.print(' ');
+    Serial.println(value);
+  }
+}
+
+void printSeq(char mark, byte seq) {
+  // Function prints a reply prefix such as "#0A "
+  Serial.print(mark);
+  if (seq < 16) {
+    Serial.print('0');
+  }
+  Serial.print(seq, HEX);
+  Serial.print(' ');
+}
+
+byte crc8(const byte *data, int length) {
+  // Function computes the CRC-8 (polynomial 0x07) used by arduino.py
+  byte crc = 0;
+  for (int i = 0; i < length; i++) {
+    crc ^= data[i];
+    for (int bit = 0; bit < 8; bit++) {
+      crc = (crc & 0x80) ? (crc << 1) ^ 0x07 : crc << 1;
+    }
+  }
+  return crc;
+}
+
 String readFromSerial() {
   // Function converts pi input into an int number
   // Inputs  - none
   // Outputs - result (int) - resultign three digit number
 
   while (Serial.available() == 0);      // wait for serial data to be available
-  unsigned long startTime = millis();   // Get start time
-  char input[6];                        // Initialize input variable
-  for (int i = 0; i < 6; i++) {         // Set the three characters
-    if (Serial.available() > 0){          // If the serial buffer has a character
-      input[i] = Serial.read();             // Add the serial character to the "input" variable
-    }
-    else {                                // If the serial buffer is empty
-      input[i] = 0;                         // Set the character to zero to push it along
-    }
-  }
+  char input[7] = {0};                  // Initialize input variable, zeros push a short command along
+  Serial.readBytes(input, 6);           // Wait up to the serial timeout for all six characters
   input[6]='\0';                        // Ending character
   String output = num2gCode(input);
   return output;                        // return the resultant integer value
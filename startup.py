@@ -0,0 +1,108 @@
+# Description - Boot readiness checks and a startup timeline for the rover
+# Notes - At boot the pi starts the control code before everything it needs is up. Instead of a fixed pause
+#         each resource is checked until it is ready or its deadline (seconds since this module was imported) passes.
+
+# Funtion List
+# mark - Adds an entry to the startup timeline
+# gpioReady - Checks the GPIO device can be opened
+# inputReady - Checks a joystick device node has been created
+# logDirReady - Checks the log folder can be written
+# waitForAll - Checks every resource together until each is ready or out of time
+# report - Prints the startup timeline
+
+# %% Start Imports ###
+import os                   # Device and folder checks
+import glob                 # Finds joystick device nodes
+import time                 # Deadlines and timeline
+### End imports ###
+
+startTime = time.monotonic()    # Time the control code started
+timeline = []                   # (seconds since startTime, what happened)
+
+#%%####### Start Custom Functions ##########
+
+
+def mark(event, write=None):
+    # Adds an entry to the startup timeline
+    # Inputs  : event - what just happened
+    #           write - function that prints the entry straight away, for steps after report was called
+    # Outputs : none
+    # Globals : timeline - Startup timeline
+
+    timeline.append((time.monotonic() - startTime, event))
+    if write:
+        write("  %7.3f s  %s" % timeline[-1])
+
+
+def gpioReady():
+    # Checks the GPIO device RPi.GPIO uses can be opened
+    # Inputs  : none
+    # Outputs : ready - True once /dev/gpiomem is readable and writable
+    return os.access('/dev/gpiomem', os.R_OK | os.W_OK)
+
+
+def inputReady():
+    # Checks the kernel and udev have created a node for a joystick, which is what SDL and evdevInput open
+    # Inputs  : none
+    # Outputs : ready - True once a /dev/input/js* node or a by-id joystick event node exists
+    return bool(glob.glob('/dev/input/js*') or glob.glob('/dev/input/by-id/*-event-joystick'))
+
+
+def logDirReady(logDir="logs"):
+    # Checks the log folder exists (creating it) and files can be written there
+    # Inputs  : logDir - folder fancy.start will log to
+    # Outputs : ready - True once a file could be written
+    try:
+        os.makedirs(logDir, exist_ok=True)
+        testFile = os.path.join(logDir, ".startupProbe")
+        with open(testFile, 'w'):
+            pass
+        os.remove(testFile)
+        return True
+    except OSError:                                 # Read-only or missing file system
+        return False
+
+
+def waitForAll(checks=None, interval=0.05):
+    # Checks every resource together until each is ready or past its deadline
+    # Inputs  : checks   - name -> (check function, deadline in seconds since startTime), the rover's needs if not given
+    #           interval - seconds between checks
+    # Outputs : ready - True if every resource was ready in time
+    # Globals : timeline - Startup timeline
+    # Example : waitForAll({"camera": (lambda: os.path.exists('/dev/video0'), 5.0)})
+
+    if checks is None:
+        checks = {"GPIO": (gpioReady, 10.0), "joystick": (inputReady, 10.0), "log folder": (logDirReady, 10.0)}
+    pending = dict(checks)
+    ready = True
+    while pending:
+        for name, (check, deadline) in list(pending.items()):
+            if check():                                     # Ready, stop checking it
+                mark(name + " ready")
+                del pending[name]
+            elif time.monotonic() - startTime >= deadline:  # Out of time, carry on without it
+                mark(name + " NOT ready after " + str(deadline) + " s")
+                del pending[name]
+                ready = False
+        if pending:
+            time.sleep(interval)
+    return ready
+
+
+def report(write=print):
+    # Prints the startup timeline, one line per entry
+    # Inputs  : write - function that prints one line
+    # Outputs : none
+    # Globals : timeline - Startup timeline
+
+    try:
+        with open('/proc/uptime') as f:             # How long after boot the control code started
+            bootAge = float(f.read().split()[0]) - (time.monotonic() - startTime)
+        write("Startup timeline (control code started %.1f s after boot)" % bootAge)
+    except (OSError, ValueError):                   # Not on linux
+        write("Startup timeline")
+    for seconds, event in timeline:
+        write("  %7.3f s  %s" % (seconds, event))
+
+
+### End Custom Functions ###
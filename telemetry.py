@@ -0,0 +1,111 @@
+# Description - Fixed-size binary ring buffer of rover events kept in a memory-mapped file
+# Notes - The buffer lives in the page cache, so records written before a crash are still in the file.
+#         Each record carries a sequence number, the newest records overwrite the oldest.
+
+# Funtion List
+# start - Opens (or creates) the ring buffer file
+# record - Writes one event into the ring buffer
+# close - Flushes and closes the ring buffer
+# load - Reads a ring buffer file into NumPy arrays, oldest record first
+
+# %% Start Imports ###
+import os                   # File sizes and folders
+import mmap                 # Memory-mapped file
+import time                 # Event timestamps
+import struct               # Fixed-width records
+### End imports ###
+
+AXIS = 1        # Joystick axis moved   - code is the axis,   value is the stick position (duty is not used)
+BUTTON = 2      # Button pressed        - code is the button
+DUTY = 3        # setDuty wrote a pin   - code is the pin,    value is the requested duty, duty the written duty
+
+magic = b"RVTL"                                 # Marks a telemetry file
+version = 1                                     # Record layout version
+header = struct.Struct("<4sHHI4x")              # magic, version, record size, capacity
+entry = struct.Struct("<QdffHH4x")              # seq, time, value, duty, kind, code
+
+ring = None         # Memory map of the ring buffer
+ringFile = None     # File behind the memory map
+capacity = 0        # Records the ring buffer holds
+seq = 0             # Sequence number of the newest record
+
+#%%####### Start Custom Functions ##########
+
+
+def start(path="logs/telemetry.bin", size=65536):
+    # Opens the ring buffer, continuing after the newest record of an earlier run
+    # Inputs  : path - ring buffer file
+    #           size - records to hold when a new file is created
+    # Outputs : none
+    # Globals : ring, ringFile, capacity, seq - Ring buffer state
+
+    global ring, ringFile, capacity, seq
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    ringFile = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+    old = ringFile.read(header.size)
+    if len(old) == header.size and header.unpack(old)[:3] == (magic, version, entry.size):     # Earlier run
+        capacity = header.unpack(old)[3]
+    else:                                                       # New or unreadable file
+        capacity = size
+        ringFile.seek(0)
+        ringFile.write(header.pack(magic, version, entry.size, capacity))
+        ringFile.truncate(header.size)                          # Old bytes would read as records, regrown as zeros
+    ringFile.truncate(header.size + capacity * entry.size)      # Preallocate every record
+    ring = mmap.mmap(ringFile.fileno(), 0)
+    seq = max((fields[0] for fields in entry.iter_unpack(ring[header.size:])), default=0)
+
+
+def record(kind, code, value=0.0, duty=0.0):
+    # Writes one event into the ring buffer, does nothing until start is called
+    # Inputs  : kind  - AXIS, BUTTON or DUTY
+    #           code  - axis, button or pin number
+    #           value - stick position or requested duty
+    #           duty  - computed or written duty
+    # Outputs : none
+    # Globals : seq - Sequence number of the newest record
+
+    global seq
+
+    if ring is None:
+        return
+    seq += 1
+    entry.pack_into(ring, header.size + seq % capacity * entry.size, seq, time.time(), value, duty, kind, code)
+
+
+def close():
+    # Flushes the ring buffer to disk and closes it
+    # Inputs  : none
+    # Outputs : none
+    # Globals : ring, ringFile - Ring buffer state
+
+    global ring, ringFile
+
+    if ring is not None:
+        ring.flush()
+        ring.close()
+        ringFile.close()
+        ring = None
+        ringFile = None
+
+
+def load(path="logs/telemetry.bin"):
+    # Reads a ring buffer file for post-run analysis
+    # Inputs  : path - ring buffer file
+    # Outputs : records - NumPy structured array sorted oldest first with fields
+    #                     seq, time, value, duty, kind, code (records['duty'] is a plain array)
+
+    import numpy as np      # Only needed for analysis, not on the rover
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    fileMagic, fileVersion, recordSize, fileCapacity = header.unpack_from(data)
+    if fileMagic != magic or fileVersion != version or recordSize != entry.size:
+        raise ValueError(path + " is not a version " + str(version) + " telemetry file")
+    layout = np.dtype({'names': ['seq', 'time', 'value', 'duty', 'kind', 'code'],
+                       'formats': ['<u8', '<f8', '<f4', '<f4', '<u2', '<u2'],
+                       'offsets': [0, 8, 16, 20, 24, 26],
+                       'itemsize': entry.size})
+    records = np.frombuffer(data, layout, fileCapacity, header.size)
+    records = records[records['seq'] > 0]                   # Skip slots that were never written
+    return records[np.argsort(records['seq'])]
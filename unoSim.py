@@ -0,0 +1,280 @@
+# Description - Stand-in for an arduino running simpleGCode.ino, served on a pseudo-terminal
+# Notes - Decodes plain, "#" sequenced and binary frame commands exactly like the sketch and echoes the same replies.
+#         Latency, jitter, baud rate, loop delay and the 64 byte receive buffer are all simulated so
+#         arduino.py can be benchmarked and regression tested without a board.
+#         Run "python3 unoSim.py" to serve a port, or "python3 unoSim.py --bench 500" to benchmark arduino.py.
+
+# Funtion List
+# UnoSim - Simulated arduino on a pty, arduino.connect(sim.port) talks to it
+# num2gCode - Same decoding as num2gCode in simpleGCode.ino
+# benchmark - Times the arduino.py send modes against a simulator
+
+# %% Start Imports ###
+import os                   # Reads and writes the pty
+import pty                  # Pseudo-terminal pair
+import tty                  # Raw mode for the pty
+import time                 # Latency and baud rate delays
+import random               # Jitter
+import select               # Waits for bytes from the pi
+import struct               # Binary frames
+import threading            # Runs the simulator beside the code under test
+### End imports ###
+
+letters = {'1': 'P', '2': 'S', '3': 'Q', '4': 'M', '5': 'R', '6': 'K', '7': 'H', '8': 'E'}
+frameSync = 0xA5            # First byte of a binary frame
+frameVersion = 1            # Frame layout the sketch understands
+frameMax = 56               # Largest payload, 14 commands
+
+#%%####### Start Custom Functions ##########
+
+
+def num2gCode(comCode):
+    # Decodes a six character command the way simpleGCode.ino does, '9' digits become '-' before toInt
+    # Inputs  : comCode - command characters, already cut at the first zero byte like an Arduino String
+    # Outputs : command - G-Code text the sketch prints
+    # Globals : none
+
+    firstChar = letters.get(comCode[:1], "")
+    secondChar = comCode[1:2]
+    if len(comCode) > 2:
+        commandNum = comCode[2:].replace("9", "-")
+        return firstChar + secondChar + " " + str(toInt(commandNum))
+    return firstChar + secondChar
+
+
+def toInt(text):
+    # Arduino String.toInt: optional sign then digits, stopping at the first other character
+    # Inputs  : text - characters to read
+    # Outputs : value - number read, 0 if there is none
+    # Globals : none
+
+    text = text.lstrip()
+    end = 1 if text[:1] in ('-', '+') else 0
+    while end < len(text) and text[end].isdigit():
+        end += 1
+    digits = text[:end]
+    return int(digits) if digits.lstrip('-+') else 0
+
+
+def crc8(data):
+    # CRC-8 (polynomial 0x07), computed bit by bit like the sketch
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for bit in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+class UnoSim:
+    """
+    Simulated arduino running simpleGCode.ino on a pseudo-terminal.
+    Example : sim = UnoSim(latency=0.002); sim.start(); arduino.connect(sim.port) ... sim.stop()
+    """
+    def __init__(self, latency=0.0, jitter=0.0, baud=115200, loopDelay=0.01, rxBuffer=64, timeout=0.05):
+        self.latency = latency              # Seconds spent on each command before its reply
+        self.jitter = jitter                # Largest random change to latency, either way
+        self.baud = baud                    # Bits per second, 10 bits per byte on the wire
+        self.loopDelay = loopDelay          # delay(10) at the end of loop()
+        self.rxBuffer = rxBuffer            # Bytes the receive buffer holds, extra bytes are lost
+        self.timeout = timeout              # Serial.setTimeout, longest wait for the rest of a command
+        self.buffer = bytearray()           # Receive buffer
+        self.commands = 0                   # Commands answered
+        self.overflows = 0                  # Bytes lost to a full receive buffer
+        self.running = False
+        self.connected = False              # True while a client has the port open
+        self.master, slave = pty.openpty()
+        tty.setraw(slave)                   # No echo or line editing
+        self.port = os.ttyname(slave)       # Device to pass to arduino.connect
+        os.close(slave)                     # Reads fail until a client opens the port, like a board resetting on open
+        self.thread = None
+
+    def start(self):
+        # Starts the simulated board, it announces itself like the sketch's setup
+        # Inputs  : none
+        # Outputs : none
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="unoSim", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        # Stops the simulated board and closes the pty
+        # Inputs  : none
+        # Outputs : none
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        os.close(self.master)
+
+    def run(self):
+        # Simulator thread, one pass per loop() of the sketch
+        # Inputs  : none
+        # Outputs : none
+        while self.running:
+            time.sleep(self.loopDelay)                      # delay(10) at the end of loop()
+            self.receive(0)                                 # Bytes that arrived during the delay
+            while self.buffer and self.running:             # Run every command waiting in the buffer
+                first = self.buffer[0]
+                if first == frameSync:                          # Binary frame
+                    self.readFrame()
+                elif first == ord('#'):                         # Sequenced command
+                    del self.buffer[:1]
+                    seq = self.readBytes(2).decode('latin-1')
+                    self.println("#" + seq + " " + self.readFromSerial())
+                elif ord('0') <= first <= ord('9'):             # Plain six digit command
+                    self.println(self.readFromSerial())
+                else:                                           # Stray byte
+                    del self.buffer[:1]
+
+    def receive(self, wait):
+        # Moves bytes from the pty into the receive buffer at the simulated baud rate
+        # Opening the port "resets" the board, which then prints the ready banner like setup()
+        # Inputs  : wait - longest time to wait for bytes
+        # Outputs : none
+        ready = select.select([self.master], [], [], wait)[0]
+        try:
+            data = os.read(self.master, 4096) if ready else b""
+        except OSError:                                 # No client has the port open
+            self.connected = False
+            self.buffer.clear()
+            time.sleep(wait)
+            return
+        if not self.connected:                          # A client just opened the port
+            self.connected = True
+            self.println("READY simpleGCode " + str(frameVersion))
+        time.sleep(len(data) * 10 / self.baud)          # Time the bytes took on the wire
+        room = self.rxBuffer - len(self.buffer)
+        if len(data) > room:                            # The real buffer would overflow
+            self.overflows += len(data) - room
+            data = data[:room]
+        self.buffer += data
+
+    def readBytes(self, count):
+        # Serial.readBytes, waits up to the serial timeout and may return fewer bytes
+        # Inputs  : count - bytes wanted
+        # Outputs : data - bytes read
+        end = time.monotonic() + self.timeout
+        while len(self.buffer) < count and time.monotonic() < end:
+            self.receive(end - time.monotonic())
+        data = bytes(self.buffer[:count])
+        del self.buffer[:count]
+        return data
+
+    def readFromSerial(self):
+        # Reads a six digit command, missing characters stay zero like the sketch's input array
+        # Inputs  : none
+        # Outputs : command - decoded G-Code text
+        while not self.buffer and self.running:         # wait for serial data to be available
+            self.receive(self.timeout)
+        data = self.readBytes(6)
+        return num2gCode(data.split(b'\0')[0].decode('latin-1'))
+
+    def readFrame(self):
+        # Reads one binary frame and answers each command, or the frame once with an error
+        # Inputs  : none
+        # Outputs : none
+        header = self.readBytes(4)
+        if len(header) < 4:
+            return
+        seq = header[2]
+        length = header[3]
+        if header[1] != frameVersion:
+            self.println("!%02X ERR version" % seq)
+            return
+        if length > frameMax or length % 4:
+            self.println("!%02X ERR length" % seq)
+            return
+        rest = self.readBytes(length + 1)
+        if len(rest) < length + 1:
+            self.println("!%02X ERR timeout" % seq)
+            return
+        if crc8(header[1:] + rest[:-1]) != rest[-1]:
+            self.println("!%02X ERR crc" % seq)
+            return
+        for i, (code, joint, value) in enumerate(struct.iter_unpack('<BBh', rest[:-1])):
+            letter = "PSQMRKHE"[code - 1] if 1 <= code <= 8 else ""
+            self.println("#%02X %s%d %d" % ((seq + i) % 256, letter, joint, value))
+
+    def println(self, text):
+        # Serial.println after the simulated per-command latency, at the simulated baud rate
+        # Inputs  : text - reply without its line ending
+        # Outputs : none
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        data = (text + "\r\n").encode('latin-1')
+        time.sleep(len(data) * 10 / self.baud)          # Time the reply takes on the wire
+        os.write(self.master, data)
+        self.commands += 1
+
+
+def benchmark(count=200, **settings):
+    # Times each way of sending arm commands through arduino.py against a simulator
+    # Inputs  : count    - commands per mode
+    #           settings - UnoSim settings (latency, jitter, baud, loopDelay)
+    # Outputs : results - mode name -> commands per second
+    # Globals : none
+
+    import io
+    import sys
+    import arduino
+
+    sim = UnoSim(**settings)
+    sim.start()
+    terminal = sys.stdout
+    sys.stdout = io.StringIO()                      # arduino.py prints every reply
+    gCodes = ["P" + str(i % 8) + " " + str(i % 500 - 250) for i in range(count)]
+    results = {}
+    try:
+        arduino.connect(sim.port)
+
+        def pipelined():
+            pipeline = arduino.ArmPipeline(window=7)
+            for gCode in gCodes:
+                pipeline.send(gCode)
+            pipeline.drain()
+
+        modes = [("tellArm", lambda: [arduino.tellArm(gCode) for gCode in gCodes]),
+                 ("tellArmBatch", lambda: arduino.tellArmBatch(gCodes)),
+                 ("ArmPipeline", pipelined),
+                 ("streamGCode", lambda: arduino.streamGCode(gCodes))]
+        for name, send in modes:
+            startTime = time.perf_counter()
+            send()
+            results[name] = count / (time.perf_counter() - startTime)
+    finally:
+        sys.stdout = terminal
+        arduino.uno.close()
+        sim.stop()
+    for name, rate in results.items():
+        print("%-14s %8.0f commands/s" % (name, rate))
+    if sim.overflows:
+        print("WARNING : " + str(sim.overflows) + " bytes overflowed the simulated receive buffer")
+    return results
+
+
+### End Custom Functions ###
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Simulated simpleGCode arduino on a pseudo-terminal")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per command")
+    parser.add_argument("--jitter", type=float, default=0.0, help="largest random change to latency")
+    parser.add_argument("--baud", type=int, default=115200, help="simulated baud rate")
+    parser.add_argument("--loop-delay", type=float, default=0.01, help="delay at the end of loop()")
+    parser.add_argument("--bench", type=int, default=0, help="benchmark arduino.py with this many commands")
+    args = parser.parse_args()
+    settings = dict(latency=args.latency, jitter=args.jitter, baud=args.baud, loopDelay=args.loop_delay)
+    if args.bench:
+        benchmark(args.bench, **settings)
+    else:
+        sim = UnoSim(**settings)
+        print("Simulated arduino on " + sim.port + "  (Ctrl+C to stop)")
+        sim.start()
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            sim.stop()